@@ -6,12 +6,18 @@ import asyncio
 import time
 import traceback
 
-import aiohttp
 from rethinkdb import RethinkDB
 import discord
 from discord.ext import commands
 
 import avaconfig as cfg
+from ext.dispatch import Dispatcher
+from ext.fetch import Fetcher
+from ext.gateway import footprint, format_footprint, lean_options, make_lean
+from ext.metrics import Metrics, RateLimitCounter, TimedConnection
+from ext.parsepool import ParsePool
+from ext.tracing import Tracer, instrument_commands
+from ext.watchdog import LoopWatchdog
 
 cog_list = [
   "admin",
@@ -19,20 +25,58 @@ cog_list = [
   "modular",
   "exec"
 ]
+# A single gateway connection unless the config asks for shards
+sharding = getattr(cfg, "sharding", None)
+# Leaves members, presences and typing out of the gateway, see ext/gateway.py
+lean_gateway = getattr(cfg, "lean_gateway", False)
 
 
-class AvaBot(commands.Bot):
+class AvaBot(commands.AutoShardedBot if sharding else commands.Bot):
   def __init__(self, **kwargs):
     super().__init__(**kwargs)
     self.prod = True if os.environ.get("pm_id") else False
     self.config = cfg
+    self.lean = lean_gateway
+    if self.lean:
+      make_lean(self._connection)
+    self.ready_after = None
+    # Messages have to start with one of these before on_message bothers with
+    # them. None if the prefix is worked out per message
+    prefix = self.command_prefix
+    self.prefixes = (prefix,) if isinstance(prefix, str) else \
+      None if callable(prefix) else tuple(prefix)
+    # With a separate poller (poller.py) this process only delivers announcements.
+    # Sharded over several processes, only the one with shard 0 polls
+    shard_ids = getattr(self, "shard_ids", None)
+    self.polls = not getattr(cfg, "poller", {}).get("separate", False) and \
+      (shard_ids is None or 0 in shard_ids)
+    self.delivers = True
 
     logging.basicConfig(
       format="[%(levelname)s] - %(message)s",
       level=logging.INFO if os.environ.get("LOG_INFO") else (
         logging.INFO if self.prod else logging.DEBUG))
     self.logger = logging.getLogger("avabot")
-    self.session = aiohttp.ClientSession(loop=self.loop)
+    # Latencies and counts for Prometheus, see ext/metrics.py
+    self.metrics = Metrics()
+    logging.getLogger("discord.http").addHandler(RateLimitCounter(self.metrics))
+    self.metrics.collectors.append(self.collect_footprint)
+    if getattr(cfg, "metrics", None):
+      self.loop.create_task(self.metrics.serve(**cfg.metrics))
+    # Samples poll cycles and commands as span traces, see ext/tracing.py
+    self.tracer = Tracer(**getattr(cfg, "tracing", {}))
+    if self.tracer.path:
+      instrument_commands(self.tracer)
+    # One pooled client for the whole bot, see ext/fetch.py
+    self.fetcher = Fetcher(loop=self.loop, metrics=self.metrics, **getattr(cfg, "http_client", {}))
+    self.session = self.fetcher.session
+    # Keeps parsing big pages from stalling the gateway, see ext/parsepool.py
+    self.parse_pool = ParsePool(metrics=self.metrics, **getattr(cfg, "parse_pool", {}))
+    # Paces and fans out announcements, see ext/dispatch.py
+    self.dispatcher = Dispatcher(metrics=self.metrics, tracer=self.tracer, **getattr(cfg, "dispatch", {}))
+    # Catches whatever blocks the event loop, see ext/watchdog.py
+    self.watchdog = LoopWatchdog(self, **getattr(cfg, "watchdog", {}))
+    self.watchdog.start()
     self.start_time = int(round(time.time() * 1000))
     self.uptime = lambda: int(round(time.time() * 1000) - self.start_time)
     self.public_dev = False
@@ -51,17 +95,63 @@ class AvaBot(commands.Bot):
 
   async def _db_connect(self):
     conn = await self.r.connect("localhost", 28015, "ava")
-    self.r_connection = conn
-    return conn
+    # Times every query by table on its way through
+    self.r_connection = TimedConnection(conn, self.metrics, self.tracer)
+    return self.r_connection
+
+  def dispatch(self, event_name, *args, **kwargs):
+    # Nearly every message isn't a command, so turn those away before they
+    # cost a task, an is_owner call and a Context. Unless something's
+    # waiting on messages, which needs to see them all
+    if event_name == "message" and self.prefixes and not self._listeners.get("message") \
+        and not self.extra_events.get("on_message") \
+        and not args[0].content.startswith(self.prefixes):
+      self.metrics.messages.inc(outcome="rejected")
+      return
+    super().dispatch(event_name, *args, **kwargs)
 
   async def on_message(self, message):
     if not self.prod and not await self.is_owner(message.author) and not self.public_dev:
+      self.metrics.messages.inc(outcome="ignored")
       return 
+    self.metrics.messages.inc(outcome="dispatched")
     ctx = await self.get_context(message)
     await self.invoke(ctx)
 
+  async def invoke(self, ctx):
+    if ctx.command is None:
+      return await super().invoke(ctx)
+    with self.tracer.root(ctx.command.qualified_name, cat="command", author=ctx.author.id):
+      await super().invoke(ctx)
+
+  def collect_footprint(self):
+    stats = footprint(self)
+    if stats["rss"]:
+      self.metrics.rss_bytes.set(stats["rss"], mode=stats["mode"])
+    self.metrics.cached_members.set(stats["members"], mode=stats["mode"])
+
+  async def on_ready(self):
+    if self.ready_after is not None:
+      return
+    # Only the first time, later ones are reconnects
+    self.ready_after = self.uptime() / 1000
+    self.metrics.startup_seconds.set(self.ready_after, mode="lean" if self.lean else "full")
+    self.logger.info(f"Ready: {format_footprint(footprint(self))}")
+
+  async def on_shard_ready(self, shard_id):
+    self.logger.info(f"Shard {shard_id}/{self.shard_count} ready")
+
+  async def on_command(self, ctx):
+    ctx.started = time.perf_counter()
+
+  async def on_command_completion(self, ctx):
+    self.metrics.command_seconds.observe(
+      time.perf_counter() - ctx.started, command=ctx.command.qualified_name, status="ok")
 
   async def on_command_error(self, ctx, error):
+    if ctx.command and hasattr(ctx, "started"):
+      self.metrics.command_seconds.observe(
+        time.perf_counter() - ctx.started, command=ctx.command.qualified_name, status="error")
     # Borrowed from Ave's rolebot:
     # https://gitlab.com/aoz/rolebot/blob/5376333bd13560cda09cbebe17b2aec09b5b9c99/rolebot.py#L80-111
     
@@ -128,6 +218,8 @@ class AvaBot(commands.Bot):
 ava = AvaBot(
   command_prefix="av!" if os.environ.get("pm_id") else "wr!",
   description="A bot that scrapes various webcomics for updates and announces them to people opted in!",
-  pm_help=None)
+  pm_help=None,
+  **(sharding or {}),
+  **(lean_options if lean_gateway else {}))
 
 ava.run(cfg.token)
@@ -1,3 +1,129 @@
 token = "<Insert token>"
 alert_channel = 000000000000000000
 new_page_role = 000000000000000000
+
+# How many feeds we fetch at once, and how many of those can share a host
+fetch_concurrency = 16
+fetch_per_host = 1
+
+# Tuning for the shared HTTP client (ext/fetch.py)
+http_client = {
+  "limit": 100,  # Total open connections
+  "limit_per_host": 4,
+  "dns_ttl": 300,  # Seconds to cache DNS lookups for
+  "keepalive_timeout": 60,
+  "timeout": 30,
+  "max_body_size": 8 * 1024 * 1024  # Bigger feeds are rejected
+}
+
+# Feed polling intervals in seconds (ext/scheduler.py). Feeds are polled every
+# poll_min_interval around their expected updates, and back off from
+# poll_interval up to poll_max_interval when nothing's happening
+poll_min_interval = 5 * 60
+poll_interval = 10 * 60
+poll_max_interval = 2 * 60 * 60
+
+# Announcement fan-out (ext/dispatch.py). Rates are (calls, per seconds) and
+# are kept a little under Discord's limits so we pace instead of getting 429s
+dispatch = {
+  "concurrency": 50,
+  "global_rate": (45, 1),
+  "message_rate": (5, 5),  # Per channel
+  "role_rate": (1, 1)  # Per guild
+}
+
+# Announcement outbox (ext/outbox.py)
+outbox = {
+  "batch_size": 200,
+  "max_attempts": 8,
+  "retry_delay": 30,  # Seconds, doubled after every failed attempt
+  "claim_timeout": 5 * 60  # Seconds before a claimed row counts as abandoned
+}
+
+# Where else new posts get published (ext/sinks.py). Each sink has its own
+# bounded queue and worker, so a slow one never holds up Discord
+mastodon = {
+  "instance_url": "",
+  "token": ""
+}
+sinks = [
+  # {"type": "webhook", "url": "https://example.com/hook", "batch_size": 20}
+]
+
+# Where pages get parsed (ext/parsepool.py): "thread", "process" or "inline"
+# (on the event loop). Processes dodge the GIL but cost a pickle per page
+parse_pool = {
+  "mode": "thread",
+  "workers": 2
+}
+
+# Prometheus metrics endpoint (ext/metrics.py), served on /metrics. Leave it
+# out to not serve metrics at all
+metrics = {
+  "host": "127.0.0.1",
+  "port": 9184
+}
+
+# Background allocation diffing (ext/memdiag.py). Every interval seconds,
+# tracemalloc is on for the next few cycles and whatever grew every cycle
+# gets logged. Sessions are spaced out so tracing stays within budget of the
+# time. Leave interval as None to only run it with the memdiag command
+memdiag = {
+  "interval": None,
+  "cycles": 3,
+  "budget": 0.05,
+  "frames": 8
+}
+
+# Event loop watchdog (ext/watchdog.py). Anything that blocks the loop for
+# threshold seconds gets its stack logged
+watchdog = {
+  "interval": 0.1,
+  "threshold": 0.5
+}
+
+# Span traces (ext/tracing.py) in Chrome's trace format, for Perfetto or
+# chrome://tracing. sample_rate of poll cycles and commands get traced. The
+# file rotates at max_bytes, keeping backups old ones. Leave it out to not trace
+tracing = {
+  "path": "traces/avabot.trace.json",
+  "sample_rate": 0.05,
+  "max_bytes": 32 * 1024 * 1024,
+  "backups": 5
+}
+
+# Polling in its own process (poller.py). With separate on, the bot stops
+# polling and only delivers what poller.py queues in the outbox table. The
+# poller serves its metrics on a port of its own
+poller = {
+  "separate": False,
+  "metrics": {
+    "host": "127.0.0.1",
+    "port": 9185
+  }
+}
+
+# Splitting feeds between several poller processes (ext/leases.py). Each one
+# polls only the feeds it holds a lease on, and feeds move on their own when
+# pollers come and go. Leave it out when there's only one poller
+# leases = {
+#   "ttl": 30,
+#   "renew_interval": 10
+# }
+
+# Gateway sharding. shard_count is the total across every process and
+# shard_ids the ones this process runs, so shards can be spread over several
+# processes. Each delivers announcements for its own guilds, and only the one
+# with shard 0 polls (unless poller.py does). Discord's global rate limit is
+# per bot, so split dispatch's global_rate between the processes. Leave it
+# out for one connection
+# sharding = {
+#   "shard_count": 4,
+#   "shard_ids": [0, 1]
+# }
+
+# Lean gateway (ext/gateway.py): no member chunking or cache, no presence or
+# typing events and no message cache. Members get fetched when a command
+# needs them. Startup time and RSS get logged when ready, and are in
+# footprint and the metrics, to compare both modes
+lean_gateway = False
@@ -0,0 +1,87 @@
+"""Responses the extractors get benchmarked against
+
+Small and typical bodies live in fixtures/ and can be refreshed from the
+live sites with `python -m bench.extractors --record`. The pathological ones
+are generated, there's no point keeping megabytes of them in git.
+"""
+import json
+import os
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+content_types = {
+  "json": "application/json",
+  "xml": "application/rss+xml",
+  "html": "text/html; charset=utf-8",
+  "js": "application/javascript"
+}
+
+
+def read_fixture(filename):
+  with open(os.path.join(FIXTURES, filename), "rb") as fixture:
+    return fixture.read()
+
+
+def huge_statuspage():
+  # Years of history with long incident write-ups, the newest one still first
+  doc = json.loads(read_fixture("statuspage-typical.json"))
+  incidents = doc["months"][0]["incidents"]
+  doc["months"] = [{
+    "name": "Month",
+    "year": 2000 + i // 12,
+    "incidents": [dict(incident, message=incident["message"] * 20) for incident in incidents] * 10
+  } for i in range(60)]
+  return json.dumps(doc).encode()
+
+
+def rss_with_huge_first_item():
+  # Streaming can't stop early if the first item is the big part
+  feed = read_fixture("rss-typical.xml").decode()
+  start = feed.index("<description>")
+  return (feed[:start] + "<description>" + "<p>Long post</p>" * 400000 + feed[start:]).encode()
+
+
+def rss_with_many_items():
+  # A feed that never drops old items, all 5MB of it
+  feed = read_fixture("rss-typical.xml").decode()
+  start = feed.index("<item>")
+  end = feed.rindex("</item>") + len("</item>")
+  items = feed[start:end]
+  return (feed[:end] + items * (5 * 1024 * 1024 // len(items)) + feed[end:]).encode()
+
+
+def egs_with_huge_comments():
+  page = read_fixture("egs-typical.html").decode()
+  comment = '<div class="cc-comment"><div class="cc-commentbody"><p>First!</p></div></div>'
+  return page.replace('<div id="comments">', '<div id="comments">' + comment * 50000).encode()
+
+
+# Each case is run against the extractor of the comic with that slug
+cases = [
+  {"name": "status_page/small", "slug": "discordstatus", "fixture": "statuspage-small.json"},
+  {"name": "status_page/typical", "slug": "discordstatus", "fixture": "statuspage-typical.json"},
+  {"name": "status_page/huge", "slug": "discordstatus", "generate": huge_statuspage, "type": "json"},
+  {"name": "common_rss/small", "slug": "questionablecontent", "fixture": "rss-small.xml"},
+  {"name": "common_rss/typical", "slug": "questionablecontent", "fixture": "rss-typical.xml"},
+  {"name": "common_rss/huge_first_item", "slug": "questionablecontent",
+   "generate": rss_with_huge_first_item, "type": "xml"},
+  {"name": "common_rss/many_items", "slug": "questionablecontent",
+   "generate": rss_with_many_items, "type": "xml"},
+  {"name": "egs_scrape/small", "slug": "egs", "fixture": "egs-small.html"},
+  {"name": "egs_scrape/typical", "slug": "egs", "fixture": "egs-typical.html"},
+  {"name": "egs_scrape/huge_comments", "slug": "egs", "generate": egs_with_huge_comments, "type": "html"},
+  {"name": "twokinds_scrape/typical", "slug": "twokinds", "fixture": "twokinds-typical.html"},
+  {"name": "avasdemon_scrape/typical", "slug": "avasdemon", "fixture": "avasdemon-typical.js"},
+  {"name": "xkcd_fetch/typical", "slug": "xkcd", "fixture": "xkcd-typical.json"}
+]
+
+
+def load(case):
+  """The body and content type for a case"""
+  if "fixture" in case:
+    body = read_fixture(case["fixture"])
+    kind = case["fixture"].rsplit(".", 1)[1]
+  else:
+    body = case["generate"]()
+    kind = case["type"]
+  return body, content_types[kind]
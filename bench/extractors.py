@@ -0,0 +1,158 @@
+"""Benchmarks every extractor against the fixture corpus, without touching the internet
+
+  python -m bench.extractors [-n 20] [--case egs] [--pool inline|thread|process]
+  python -m bench.extractors --record  # Refresh fixtures/ from the live sites
+
+Requests go to a local stand-in server instead of the real sites, through
+the same Fetcher and parse pool the bot uses. For each case it reports the
+median and worst wall time and CPU time of a call, the peak memory traced
+during a call, and how many memory blocks a call allocated and kept.
+"""
+import argparse
+import asyncio
+import functools
+import math
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+import aiohttp
+from rethinkdb import RethinkDB
+
+from ext.extract import fill_template
+from ext.fetch import Fetcher
+from ext.modular import webcomics
+from ext.parsepool import ParsePool
+from ext.tracing import Tracer
+
+from . import corpus
+from .standin import StandIn
+
+comic_dict = {comic["slug"]: comic for comic in webcomics}
+
+
+class StandInFetcher(Fetcher):
+  """Sends every request to the stand-in's path for the case being run"""
+
+  def __init__(self, stand_in, **kwargs):
+    super().__init__(**kwargs)
+    self.stand_in = stand_in
+    self.path = None
+
+  async def request(self, url, *args, **kwargs):
+    return await super().request(self.stand_in + self.path, *args, **kwargs)
+
+  async def stream(self, url, *args, **kwargs):
+    return await super().stream(self.stand_in + self.path, *args, **kwargs)
+
+
+class BenchBot:
+  """Just the parts of the bot extractors use"""
+
+  def __init__(self, fetcher, parse_pool):
+    self.fetcher = fetcher
+    self.parse_pool = parse_pool
+    self.tracer = Tracer()
+    self.r = RethinkDB()
+
+
+def case_path(case):
+  return "/" + case["name"]
+
+
+async def measure(bot, case, runs):
+  comic = comic_dict[case["slug"]]
+  extractor = comic["check_updates"]
+  bot.fetcher.path = case_path(case)
+  # Warm up, and make sure the fixture still has what the extractor wants
+  results = await extractor(comic, bot)
+
+  walls, cpus = [], []
+  for _ in range(runs):
+    wall, cpu = time.perf_counter(), time.process_time()
+    await extractor(comic, bot)
+    walls.append(time.perf_counter() - wall)
+    cpus.append(time.process_time() - cpu)
+
+  # Tracing slows everything down, so memory gets its own runs
+  peaks, blocks = [], []
+  tracemalloc.start()
+  for _ in range(runs):
+    tracemalloc.clear_traces()
+    before = sys.getallocatedblocks()
+    await extractor(comic, bot)
+    blocks.append(sys.getallocatedblocks() - before)
+    peaks.append(tracemalloc.get_traced_memory()[1])
+  tracemalloc.stop()
+
+  return {
+    "id": results["latest_post"]["unique_id"],
+    "wall": statistics.median(walls),
+    "wall_max": max(walls),
+    "cpu": statistics.median(cpus),
+    "cpu_max": max(cpus),
+    "peak": statistics.median(peaks),
+    "blocks": statistics.median(blocks)
+  }
+
+
+async def run(cases, runs, pool_mode):
+  responses = {case_path(case): functools.partial(corpus.load, case) for case in cases}
+  with StandIn(responses) as stand_in:
+    # The generated cases go over the bot's body limit on purpose, it's the
+    # parsing they're here to measure
+    bot = BenchBot(StandInFetcher(stand_in.url, max_body_size=64 * 1024 * 1024),
+                   ParsePool(mode=pool_mode))
+    print(f"{'case':<30} {'wall ms':>15} {'cpu ms':>15} {'peak KiB':>10} {'blocks':>8}  id")
+    try:
+      for case in cases:
+        result = await measure(bot, case, runs)
+        print(f"{case['name']:<30} "
+              f"{result['wall'] * 1000:>7.2f}/{result['wall_max'] * 1000:<7.2f} "
+              f"{result['cpu'] * 1000:>7.2f}/{result['cpu_max'] * 1000:<7.2f} "
+              f"{result['peak'] / 1024:>10.0f} {result['blocks']:>8.0f}  {result['id']}")
+    finally:
+      bot.parse_pool.close()
+      await bot.fetcher.close()
+  print(bot.parse_pool.format_stats())
+
+
+async def record(cases):
+  """Saves what the live sites serve now over the fixture files"""
+  async with aiohttp.ClientSession() as session:
+    for case in cases:
+      if "fixture" not in case:
+        continue
+      comic = comic_dict[case["slug"]]
+      url = fill_template(comic["check_updates"].url, {**comic, "timestamp": math.floor(time.time())})
+      async with session.get(url) as resp:
+        if resp.status != 200:
+          print(f"Skipping {case['name']}, {url} returned {resp.status}")
+          continue
+        body = await resp.read()
+      with open(os.path.join(corpus.FIXTURES, case["fixture"]), "wb") as fixture:
+        fixture.write(body)
+      print(f"Recorded {case['name']} from {url} ({len(body)} bytes)")
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Benchmarks the extractors offline")
+  parser.add_argument("-n", "--runs", type=int, default=20, help="Calls per case")
+  parser.add_argument("--case", help="Only run cases whose name contains this")
+  parser.add_argument("--pool", default="inline", choices=ParsePool.modes,
+                      help="Parse pool mode, inline keeps parsing in the CPU time")
+  parser.add_argument("--record", action="store_true", help="Refresh the fixtures from the live sites")
+  args = parser.parse_args()
+
+  cases = [case for case in corpus.cases if not args.case or args.case in case["name"]]
+  loop = asyncio.get_event_loop()
+  if args.record:
+    loop.run_until_complete(record(cases))
+  else:
+    loop.run_until_complete(run(cases, args.runs, args.pool))
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,136 @@
+"""Thousands of synthetic feeds served from one local process
+
+Three kinds of feed, shaped like the real ones our extractors read:
+  /rss/{n}                      RSS, newest item first
+  /status/{n}/history.json      statuspage history
+  /html/{n}/                    an EGS style comic page
+Feed n gets a new post every update_every seconds or so (each feed runs at
+its own rate), and answers conditional requests like a well behaved server.
+Responses can be delayed, fail, or trickle in slowly, all at random at the
+configured rates. Feeds are spread over several ports so the client sees
+them as different hosts.
+"""
+import asyncio
+import json
+import random
+import time
+
+from aiohttp import web
+
+defaults = {
+  "ports": 32,
+  "latency": 0.05,  # Mean seconds before responding
+  "error_rate": 0.01,  # Chance of a 503
+  "slow_rate": 0.01,  # Chance of the body dripping in
+  "drip_chunk": 512,
+  "drip_delay": 0.05,  # Seconds between dripped chunks
+  "update_every": 60 * 60,
+  "items": 10,  # RSS items/incidents per feed
+  "padding": 1024  # Bytes of filler per item, to get realistic body sizes
+}
+
+
+def period(settings, n):
+  # Spread feeds between half and one and a half times update_every
+  return settings["update_every"] * (0.5 + (n * 2654435761 % 1000) / 1000)
+
+
+def latest_post(settings, n, now=None):
+  return int(((now or time.time()) + n * 7919) // period(settings, n))
+
+
+def render_rss(settings, n, post):
+  # No digits in the titles, so common_rss takes the ID from the link
+  filler = "x" * settings["padding"]
+  items = "".join(f"""
+  <item>
+   <title>A new page!</title>
+   <link>http://farm.invalid/{n}/comic/{post - i}</link>
+   <pubDate>Fri, 16 Oct 2020 04:00:00 +0000</pubDate>
+   <description><![CDATA[<p>{filler}</p>]]></description>
+  </item>""" for i in range(settings["items"]))
+  return f"""<?xml version="1.0" encoding="UTF-8"?>
+<rss version="2.0">
+ <channel>
+  <title>Feed {n}</title>
+  <link>http://farm.invalid/{n}</link>{items}
+ </channel>
+</rss>
+""".encode(), "application/rss+xml"
+
+
+def render_status(settings, n, post):
+  incidents = [{
+    "name": f"Incident {post - i} on feed {n}",
+    "code": f"{n}x{post - i}",
+    "impact": "minor",
+    "message": "x" * settings["padding"]
+  } for i in range(settings["items"])]
+  return json.dumps({"months": [{"name": "October", "year": 2020, "incidents": incidents}]}).encode(), \
+    "application/json"
+
+
+def render_html(settings, n, post):
+  comments = "".join(f'<div class="cc-comment"><p>{"x" * settings["padding"]}</p></div>'
+                     for _ in range(settings["items"]))
+  return f"""<!DOCTYPE html>
+<html><head><title>Feed {n}</title></head><body>
+<div id="leftarea">
+<div id="cc-comicbody"><img title="page-{post}" src="http://farm.invalid/{n}/{post}.png" id="cc-comic"></div>
+<div style="font-family: 'Trebuchet MS'">Page {post} of feed {n}</div>
+<div id="comments">{comments}</div>
+</div></body></html>
+""".encode(), "text/html; charset=utf-8"
+
+
+renderers = {
+  "rss": render_rss,
+  "status": render_status,
+  "html": render_html
+}
+
+
+def serve(settings, port_pipe):
+  settings = {**defaults, **settings}
+  loop = asyncio.new_event_loop()
+  asyncio.set_event_loop(loop)
+
+  async def handle(request):
+    kind = request.match_info["kind"]
+    n = int(request.match_info["n"])
+    if settings["latency"]:
+      await asyncio.sleep(random.expovariate(1 / settings["latency"]))
+    if random.random() < settings["error_rate"]:
+      return web.Response(status=503)
+
+    post = latest_post(settings, n)
+    etag = f'"{n}-{post}"'
+    if request.headers.get("If-None-Match") == etag:
+      return web.Response(status=304, headers={"ETag": etag})
+    body, content_type = renderers[kind](settings, n, post)
+    headers = {"ETag": etag, "Content-Type": content_type}
+
+    if random.random() >= settings["slow_rate"]:
+      return web.Response(body=body, headers=headers)
+    resp = web.StreamResponse(headers=headers)
+    resp.content_length = len(body)
+    await resp.prepare(request)
+    for i in range(0, len(body), settings["drip_chunk"]):
+      await resp.write(body[i:i + settings["drip_chunk"]])
+      await asyncio.sleep(settings["drip_delay"])
+    await resp.write_eof()
+    return resp
+
+  app = web.Application()
+  app.router.add_get("/{kind:rss}/{n}", handle)
+  app.router.add_get("/{kind:status}/{n}/history.json", handle)
+  app.router.add_get("/{kind:html}/{n}/", handle)
+  runner = web.AppRunner(app, access_log=None)
+  loop.run_until_complete(runner.setup())
+  ports = []
+  for _ in range(settings["ports"]):
+    site = web.TCPSite(runner, "127.0.0.1", 0, backlog=1024)
+    loop.run_until_complete(site.start())
+    ports.append(site._server.sockets[0].getsockname()[1])
+  port_pipe.send(ports)
+  loop.run_forever()
@@ -0,0 +1 @@
+var ad_cql="76617220706167654c696e6b313d2270616765732e7068702330303031223b0a76617220706167654c696e6b323d2270616765732e7068702330303032223b0a76617220706167654c696e6b333d2270616765732e7068702330303033223b0a76617220706167654c696e6b343d2270616765732e7068702330303034223b0a76617220706167654c696e6b353d2270616765732e7068702330303035223b0a76617220706167654c696e6b363d2270616765732e7068702330303036223b0a76617220706167654c696e6b373d2270616765732e7068702330303037223b0a76617220706167654c696e6b383d2270616765732e7068702330303038223b0a76617220706167654c696e6b393d2270616765732e7068702330303039223b0a76617220706167654c696e6b31303d2270616765732e7068702330303130223b0a76617220706167654c696e6b31313d2270616765732e7068702330303131223b0a76617220706167654c696e6b31323d2270616765732e7068702330303132223b0a76617220706167654c696e6b31333d2270616765732e7068702330303133223b0a76617220706167654c696e6b31343d2270616765732e7068702330303134223b0a76617220706167654c696e6b31353d2270616765732e7068702330303135223b0a76617220706167654c696e6b31363d2270616765732e7068702330303136223b0a76617220706167654c696e6b31373d2270616765732e7068702330303137223b0a76617220706167654c696e6b31383d2270616765732e7068702330303138223b0a76617220706167654c696e6b31393d2270616765732e7068702330303139223b0a76617220706167654c696e6b32303d2270616765732e7068702330303230223b0a76617220706167654c696e6b32313d2270616765732e7068702330303231223b0a76617220706167654c696e6b32323d2270616765732e7068702330303232223b0a76617220706167654c696e6b32333d2270616765732e7068702330303233223b0a76617220706167654c696e6b32343d2270616765732e7068702330303234223b0a76617220706167654c696e6b32353d2270616765732e7068702330303235223b0a76617220706167654c696e6b32363d2270616765732e7068702330303236223b0a76617220706167654c696e6b32373d2270616765732e7068702330303237223b0a76617220706167654c696e6b32383d2270616765732e7068702330303238223b0a76617220706167654c696e6b32393d2270616765732e7068702330303239223b0a76617220706167654c696e6b33303d2270616765732e7068702330303330223b0a76617220706167654c696e6b33313d2270616765732e7068702330303331223b0a76617220706167654c696e6b33323d2270616765732e7068702330303332223b0a76617220706167654c696e6b33333d2270616765732e7068702330303333223b0a76617220706167654c696e6b33343d2270616765732e7068702330303334223b0a76617220706167654c696e6b33353d2270616765732e7068702330303335223b0a76617220706167654c696e6b33363d2270616765732e7068702330303336223b0a76617220706167654c696e6b33373d2270616765732e7068702330303337223b0a76617220706167654c696e6b33383d2270616765732e7068702330303338223b0a76617220706167654c696e6b33393d2270616765732e7068702330303339223b0a76617220706167654c696e6b34303d2270616765732e7068702330303430223b0a76617220706167654c696e6b34313d2270616765732e7068702330303431223b0a76617220706167654c696e6b34323d2270616765732e7068702330303432223b0a76617220706167654c696e6b34333d2270616765732e7068702330303433223b0a76617220706167654c696e6b34343d2270616765732e7068702330303434223b0a76617220706167654c696e6b34353d2270616765732e7068702330303435223b0a76617220706167654c696e6b34363d2270616765732e7068702330303436223b0a76617220706167654c696e6b34373d2270616765732e7068702330303437223b0a76617220706167654c696e6b34383d2270616765732e7068702330303438223b0a76617220706167654c696e6b34393d2270616765732e7068702330303439223b0a76617220706167654c696e6b35303d2270616765732e7068702330303530223b0a76617220706167654c696e6b35313d2270616765732e7068702330303531223b0a76617220706167654c696e6b35323d2270616765732e7068702330303532223b0a76617220706167654c696e6b35333d2270616765732e7068702330303533223b0a76617220706167654c696e6b35343d2270616765732e7068702330303534223b0a76617220706167654c696e6b35353d2270616765732e7068702330303535223b0a76617220706167654c696e6b35363d2270616765732e7068702330303536223b0a76617220706167654c696e6b35373d2270616765732e7068702330303537223b0a76617220706167654c696e6b35383d2270616765732e7068702330303538223b0a76617220706167654c696e6b35393d2270616765732e7068702330303539223b0a76617220706167654c696e6b36303d2270616765732e7068702330303630223b0a76617220706167654c696e6b36313d2270616765732e7068702330303631223b0a76617220706167654c696e6b36323d2270616765732e7068702330303632223b0a76617220706167654c696e6b36333d2270616765732e7068702330303633223b0a76617220706167654c696e6b36343d2270616765732e7068702330303634223b0a76617220706167654c696e6b36353d2270616765732e7068702330303635223b0a76617220706167654c696e6b36363d2270616765732e7068702330303636223b0a76617220706167654c696e6b36373d2270616765732e7068702330303637223b0a76617220706167654c696e6b36383d2270616765732e7068702330303638223b0a76617220706167654c696e6b36393d2270616765732e7068702330303639223b0a76617220706167654c696e6b37303d2270616765732e7068702330303730223b0a76617220706167654c696e6b37313d2270616765732e7068702330303731223b0a76617220706167654c696e6b37323d2270616765732e7068702330303732223b0a76617220706167654c696e6b37333d2270616765732e7068702330303733223b0a76617220706167654c696e6b37343d2270616765732e7068702330303734223b0a76617220706167654c696e6b37353d2270616765732e7068702330303735223b0a76617220706167654c696e6b37363d2270616765732e7068702330303736223b0a76617220706167654c696e6b37373d2270616765732e7068702330303737223b0a76617220706167654c696e6b37383d2270616765732e7068702330303738223b0a76617220706167654c696e6b37393d2270616765732e7068702330303739223b0a766172206c6174657374436f6d69634c696e6b48746d6c3d313931323b0a766172206669727374436f6d69634c696e6b48746d6c3d313b0a";
\ No newline at end of file
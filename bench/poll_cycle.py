@@ -0,0 +1,208 @@
+"""Runs full Modular.check_updates cycles against a farm of synthetic feeds
+
+  python -m bench.poll_cycle [--feeds 1000,10000,50000] [--cycles 3] [--latency 0.05] ...
+
+Everything runs on this machine: the feeds come from bench/farm.py in a
+child process, and the updates/validators tables are kept in memory rather
+than in RethinkDB. Each feed count gets a fresh process, and for each cycle
+it reports how long it took, requests per second and the event loop's lag
+while it ran, then the process's memory high-water mark.
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import resource
+import time
+
+from rethinkdb import RethinkDB
+
+from ext.extract import Extractor
+from ext.fetch import Fetcher, ValidatorStore
+from ext.metrics import Metrics
+from ext.modular import Modular, common_rss, egs_scrape, status_page
+from ext.parsepool import ParsePool
+from ext.scheduler import FeedSchedule
+from ext.state import TableCache
+from ext.tracing import Tracer
+
+from . import farm
+
+# status_page only fetches over https, the farm only speaks http
+farm_status_page = Extractor({**status_page.spec, "url": "http://{statuspage_url}/history.json"})
+
+
+class MemoryTableCache(TableCache):
+  """A TableCache that never writes back, for running without a database"""
+
+  def __init__(self, bot, table):
+    super().__init__(bot, table)
+    self.loaded = True
+
+  async def flush(self):
+    self.dirty = set()
+
+
+class FarmConfig:
+  def __init__(self, concurrency, per_host):
+    self.fetch_concurrency = concurrency
+    self.fetch_per_host = per_host
+
+
+class FarmBot:
+  """Just the parts of the bot Modular uses while checking for updates"""
+
+  prod = False
+  polls = True
+  delivers = False
+
+  def __init__(self, loop, config, pool_mode, verbose, trace=None):
+    self.loop = loop
+    self.config = config
+    self.logger = logging.getLogger("farm")
+    self.logger.setLevel(logging.INFO if verbose else logging.CRITICAL)
+    self.metrics = Metrics()
+    self.fetcher = Fetcher(loop=loop, metrics=self.metrics)
+    self.parse_pool = ParsePool(mode=pool_mode, metrics=self.metrics)
+    self.tracer = Tracer(trace, sample_rate=1)
+    self.r = RethinkDB()
+    # Never connects, so nothing that needs the database ever starts
+    self.db_connect_task = loop.create_future()
+
+  def is_ready(self):
+    return False
+
+
+def farm_comics(count, ports, mix):
+  kinds = [kind for kind, share in mix.items() for _ in range(share)]
+  comics = []
+  for n in range(count):
+    kind = kinds[n % len(kinds)]
+    host = f"127.0.0.1:{ports[n % len(ports)]}"
+    comic = {"slug": f"farm{n}", "friendly": f"Farm feed {n}", "host": host}
+    if kind == "rss":
+      comic.update(check_updates=common_rss, rss_url=f"http://{host}/rss/{n}")
+    elif kind == "status":
+      comic.update(check_updates=farm_status_page, statuspage_url=f"{host}/status/{n}")
+    else:
+      comic.update(check_updates=egs_scrape, base_url=f"http://{host}/html/{n}/")
+    comics.append(comic)
+  return comics
+
+
+async def watch_lag(lags, interval=0.05):
+  while True:
+    started = time.monotonic()
+    await asyncio.sleep(interval)
+    lags.append(time.monotonic() - started - interval)
+
+
+async def run_cycles(args, ports, report):
+  loop = asyncio.get_event_loop()
+  bot = FarmBot(loop, FarmConfig(args.concurrency, args.per_host), args.pool, args.verbose,
+                args.trace)
+  modular = Modular(bot)
+  modular.updates = MemoryTableCache(bot, "updates")
+  modular.validator_cache = MemoryTableCache(bot, "validators")
+  bot.fetcher.validators = ValidatorStore(modular.validator_cache)
+  # No subscriptions, so announcing never needs the database either
+  modular.sub_index.ready.set()
+
+  comics = farm_comics(args.feeds, ports, args.mix)
+  for comic in comics:
+    modular.scheduler.add(FeedSchedule(comic["slug"]))
+
+  try:
+    for cycle in range(args.cycles):
+      lags = []
+      watcher = loop.create_task(watch_lag(lags))
+      requests = bot.fetcher.stats["requests"]
+      not_modified = bot.fetcher.stats["not_modified"]
+      started = time.monotonic()
+      await modular.check_updates(comics)
+      elapsed = time.monotonic() - started
+      watcher.cancel()
+      lags.sort()
+      report.send({
+        "cycle": cycle + 1,
+        "elapsed": elapsed,
+        "requests": bot.fetcher.stats["requests"] - requests,
+        "not_modified": bot.fetcher.stats["not_modified"] - not_modified,
+        "lag_p99": lags[int(len(lags) * 0.99)] if lags else 0,
+        "lag_max": lags[-1] if lags else 0
+      })
+      if args.pause:
+        await asyncio.sleep(args.pause)
+  finally:
+    modular.cog_unload()
+    bot.parse_pool.close()
+    await bot.fetcher.close()
+  # ru_maxrss is in KiB on Linux
+  report.send({"maxrss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss})
+
+
+def run_scale(args, ports, report):
+  asyncio.set_event_loop(asyncio.new_event_loop())
+  asyncio.get_event_loop().run_until_complete(run_cycles(args, ports, report))
+  report.send(None)
+
+
+def parse_mix(mix):
+  shares = {}
+  for part in mix.split(","):
+    kind, share = part.split("=")
+    if kind not in farm.renderers:
+      raise argparse.ArgumentTypeError(f"Unknown feed kind: {kind}")
+    shares[kind] = int(share)
+  return shares
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Scale tests the poll cycle against synthetic feeds")
+  parser.add_argument("--feeds", default="1000,10000,50000", help="Feed counts to run, comma separated")
+  parser.add_argument("--cycles", type=int, default=3, help="Poll cycles per feed count")
+  parser.add_argument("--pause", type=float, default=0, help="Seconds between cycles")
+  parser.add_argument("--mix", type=parse_mix, default=parse_mix("rss=6,status=2,html=2"),
+                      help="Relative share of each kind of feed")
+  parser.add_argument("--concurrency", type=int, default=16, help="fetch_concurrency")
+  parser.add_argument("--per-host", type=int, default=1, help="fetch_per_host")
+  parser.add_argument("--pool", default="thread", choices=ParsePool.modes, help="Parse pool mode")
+  for name, default in farm.defaults.items():
+    parser.add_argument("--" + name.replace("_", "-"), type=type(default), default=default)
+  parser.add_argument("--trace", help="Write every cycle's spans to this trace file")
+  parser.add_argument("-v", "--verbose", action="store_true", help="Show the bot's logging")
+  args = parser.parse_args()
+  logging.basicConfig(format="[%(levelname)s] - %(message)s")
+
+  farm_settings = {name: getattr(args, name) for name in farm.defaults}
+  parent, child = multiprocessing.Pipe()
+  server = multiprocessing.Process(target=farm.serve, args=(farm_settings, child), daemon=True)
+  server.start()
+  ports = parent.recv()
+
+  try:
+    for feeds in [int(count) for count in args.feeds.split(",")]:
+      args.feeds = feeds
+      parent, child = multiprocessing.Pipe()
+      driver = multiprocessing.Process(target=run_scale, args=(args, ports, child))
+      driver.start()
+      print(f"{feeds} feeds")
+      while True:
+        result = parent.recv()
+        if result is None:
+          break
+        if "maxrss" in result:
+          print(f"  memory high-water mark {result['maxrss'] / 1024:.0f} MiB")
+          continue
+        print(f"  cycle {result['cycle']}: {result['elapsed']:.1f}s, "
+              f"{result['requests'] / result['elapsed']:.0f} req/s, "
+              f"{result['not_modified']} not modified, "
+              f"loop lag p99 {result['lag_p99'] * 1000:.1f}ms max {result['lag_max'] * 1000:.1f}ms")
+      driver.join()
+  finally:
+    server.terminate()
+    server.join()
+
+
+if __name__ == "__main__":
+  main()
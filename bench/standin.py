@@ -0,0 +1,51 @@
+"""A local HTTP server standing in for the sites we scrape
+
+It runs in its own process so serving doesn't show up in the CPU time and
+memory of whatever's being measured.
+"""
+import asyncio
+import multiprocessing
+
+from aiohttp import web
+
+
+def serve(responses, port_pipe):
+  """responses maps paths to a function returning (body, content type)"""
+  loop = asyncio.new_event_loop()
+  asyncio.set_event_loop(loop)
+  bodies = {path: load() for path, load in responses.items()}
+
+  async def handle(request):
+    if request.path not in bodies:
+      return web.Response(status=404)
+    body, content_type = bodies[request.path]
+    return web.Response(body=body, headers={"Content-Type": content_type})
+
+  app = web.Application()
+  app.router.add_get("/{path:.*}", handle)
+  runner = web.AppRunner(app, access_log=None)
+  loop.run_until_complete(runner.setup())
+  site = web.TCPSite(runner, "127.0.0.1", 0)
+  loop.run_until_complete(site.start())
+  port_pipe.send(site._server.sockets[0].getsockname()[1])
+  loop.run_forever()
+
+
+class StandIn:
+  """Starts serve() in a child process, usable as a context manager"""
+
+  def __init__(self, responses):
+    self.responses = responses
+    self.process = None
+    self.url = None
+
+  def __enter__(self):
+    parent, child = multiprocessing.Pipe()
+    self.process = multiprocessing.Process(target=serve, args=(self.responses, child), daemon=True)
+    self.process.start()
+    self.url = f"http://127.0.0.1:{parent.recv()}"
+    return self
+
+  def __exit__(self, *exc):
+    self.process.terminate()
+    self.process.join()
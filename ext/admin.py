@@ -31,6 +31,7 @@ import discord
 from discord.ext import commands
 
 from .common import Cog, hastebin
+from .gateway import footprint, format_footprint
 
 log = logging.getLogger(__name__)
 
@@ -287,11 +288,30 @@ class Admin(Cog):
         attachment.save(f)
       await ctx.send(f"saved as {attachment.filename}")
 
+  @commands.command()
+  @commands.is_owner()
+  async def stalls(self, ctx):
+    """Shows the last few times something blocked the event loop"""
+    watchdog = self.bot.watchdog
+    if not watchdog.stalls:
+      return await ctx.send(f"Nothing has blocked the loop for {watchdog.threshold}s or more")
+    report = "\n\n".join(watchdog.format(stall) for stall in reversed(watchdog.stalls))
+    if len(report) < 1900:
+      return await ctx.send(f"```\n{report}\n```")
+    await ctx.send(file=discord.File(io.BytesIO(report.encode()), filename="stalls.txt"))
+
+  @commands.command()
+  @commands.is_owner()
+  async def footprint(self, ctx):
+    """Shows startup time, memory and what discord.py is caching"""
+    await ctx.send(format_footprint(footprint(self.bot)))
+
   @commands.command(alias=["shutdown", "off", "poweroff"])
   @commands.is_owner()
   async def die(self, ctx):
     """Shuts down the bot safely"""
     await ctx.send("oof.")
+    self.bot.watchdog.stop()
     if self.bot.r_connection:
       await self.bot.r_connection.close()
     if self.bot.session:
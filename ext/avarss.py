@@ -3,12 +3,15 @@ import urllib.parse as urlparse
 
 import discord
 import aiohttp
-import lxml.html
-import lxml.etree
 from discord.ext import commands
 
 import avaconfig as cfg
-from .common import Cog
+from .common import Cog, fetch_member
+from .feedparse import ItemParser
+
+
+class RSSException(Exception):
+  pass
 
 
 class AvaRSS(Cog):
@@ -18,7 +21,6 @@ class AvaRSS(Cog):
     super().__init__(bot)
     self.file_handle = open("latest_page.txt", "r+")
     self.last_known_page = int(self.file_handle.read()) or 0
-    self.reencode_parser = lxml.etree.XMLParser(encoding="utf-8")
     self.check_loop = None
     self.ready = False
     if self.bot.is_ready():
@@ -40,44 +42,43 @@ class AvaRSS(Cog):
 
   async def check_rss(self):
     self.bot.logger.info("Downloading RSS feed")
-    async with self.bot.session.get("http://feeds.feedburner.com/AvasDemon?format=xml") as resp:
-      original_text = await resp.text()
-      if resp.status == 200:
-        self.bot.logger.info("Downloaded RSS feed successfully!")
-        # Ugh, we have to re-encode it because they have an encoding
-        # declaration... See:
-        # http://lxml.de/parsing.html#python-unicode-strings
-        text_reencoded = original_text.encode("utf-8")
-        parsed = lxml.etree.fromstring(
-          text_reencoded, parser=self.reencode_parser)
-        links = parsed.cssselect("rss channel item link")
-        # This looks confusing, but what we do here is like map() but
-        # that might be removed at some point?
-        pages = [{
-          "number": self.parse_number(page_link.text),
-          "link": page_link.text
-        } for page_link in links]
-
-        if pages[0]["number"] == self.last_known_page:
-          self.bot.logger.info("No new pages")
-        else:
-          self.bot.logger.info("Found a new page!")
-          new_pages = [
-            page for page in pages if page["number"] > self.last_known_page]
-          await self.announce_pages(new_pages[-1], new_pages[0])
-          self.last_known_page = pages[0]["number"]
-          # Write back our stuff
-          self.file_handle.seek(0)
-          self.file_handle.write(str(self.last_known_page))
-          self.file_handle.truncate()
+    # Newest pages come first, so we can stop reading at the first page we've
+    # already announced. The raw bytes go straight to lxml, which deals with
+    # the feed's encoding declaration itself
+    parser = ItemParser(
+      fields=("link",),
+      limit=None,
+      stop=lambda item: self.parse_number(item["link"]) <= self.last_known_page)
+    resp = await self.bot.fetcher.stream("http://feeds.feedburner.com/AvasDemon?format=xml", parser,
+                                         pool=self.bot.parse_pool)
+    if resp["resp"].status == 200:
+      self.bot.logger.info("Downloaded RSS feed successfully!")
+      pages = [{
+        "number": self.parse_number(item["link"]),
+        "link": item["link"]
+      } for item in resp["result"]]
+
+      if pages[0]["number"] == self.last_known_page:
+        self.bot.logger.info("No new pages")
       else:
-        raise RSSException(original_text)
+        self.bot.logger.info("Found a new page!")
+        new_pages = [
+          page for page in pages if page["number"] > self.last_known_page]
+        await self.announce_pages(new_pages[-1], new_pages[0])
+        self.last_known_page = pages[0]["number"]
+        # Write back our stuff
+        self.file_handle.seek(0)
+        self.file_handle.write(str(self.last_known_page))
+        self.file_handle.truncate()
+    else:
+      raise RSSException(f"Non-200 status code: {resp['resp'].status}")
 
   async def announce_pages(self, oldest_page, newest_page):
     """Alerts the users of a new page!"""
     newest_page_n = newest_page["number"]
     oldest_page_n = oldest_page["number"]
     oldest_page_link = oldest_page["link"]
+    deliveries = []
     for guild in self.bot.guilds:
       try:
         self.bot.logger.debug(f"Announcing new page in {guild.name}")
@@ -88,26 +89,24 @@ class AvaRSS(Cog):
           "role_id")) if guild_config.get("role_id") else None
 
         self.bot.logger.debug(f"Got past role part for {guild.name}")
-
-        if self.bot.prod and new_page_role:
-          await new_page_role.edit(mentionable=True,
-                       reason="New page!")
-        elif new_page_role:
-          await new_page_role.edit(mentionable=False,
-                       reason="Local bot, new page without ping")
-        role_mention_str = new_page_role.mention if new_page_role else ""
-        await channel.send(f"{role_mention_str} More Ava's demon pages!!\n"
-                   f"Pages {oldest_page_n}-{newest_page_n} were just released"
-                   f"({newest_page_n - oldest_page_n} pages)!\n"
-                   f"View: {oldest_page_link}")
-
-        if self.bot.prod and new_page_role:
-          await new_page_role.edit(mentionable=False,
-                       reason="New page!")
+        deliveries.append({
+          "channel": channel,
+          "role": new_page_role,
+          "content": f"More Ava's demon pages!!\n"
+                     f"Pages {oldest_page_n}-{newest_page_n} were just released"
+                     f"({newest_page_n - oldest_page_n} pages)!\n"
+                     f"View: {oldest_page_link}",
+          "mention_format": "{mention} {content}"
+        })
       except discord.DiscordException as err:
         self.bot.logger.warning(
           f"Discord threw an error when we announced in {guild.name}: {err}")
 
+    # Pings without toggling the role where we can, see Dispatcher.announce
+    report = await self.bot.dispatcher.announce(deliveries, ping=self.bot.prod, reason="New page!")
+    for err in report["errors"]:
+      self.bot.logger.warning(f"Discord threw an error when we announced a new page: {err}")
+
   @commands.group()
   @commands.guild_only()
   async def settings(self, ctx):
@@ -206,11 +205,12 @@ class AvaRSS(Cog):
     new_page_role = discord.utils.get(
       channel.guild.roles, id=guild_config["role_id"])
 
-    if new_page_role not in ctx.author.roles:
-      await ctx.author.add_roles(new_page_role, reason="Subscribed to page updates", atomic=True)
+    member = await fetch_member(channel.guild, ctx.author)
+    if new_page_role not in member.roles:
+      await member.add_roles(new_page_role, reason="Subscribed to page updates", atomic=True)
       subscribed = True
     else:
-      await ctx.author.remove_roles(new_page_role, reason="Unsubscribed from page updates", atomic=True)
+      await member.remove_roles(new_page_role, reason="Unsubscribed from page updates", atomic=True)
       subscribed = False
 
     action_message = "Subscribed to" if subscribed else "Unsubscribed from"
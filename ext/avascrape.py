@@ -1,6 +1,6 @@
 import asyncio
+import time
 import urllib.parse as parse
-from datetime import datetime
 
 import aiohttp
 import discord
@@ -8,7 +8,8 @@ from discord.ext import commands
 from lxml import html
 
 import avaconfig as cfg
-from .common import Cog
+from .common import Cog, fetch_member
+from .scheduler import FeedSchedule, UpdateWindow
 
 
 class AvaScrape(Cog):
@@ -17,6 +18,13 @@ class AvaScrape(Cog):
   def __init__(self, bot):
     super().__init__(bot)
     self.scrape_days = [2, 3, 4]
+    # Scrape every 15 minutes on update days (in local time, like it always
+    # has), and not at all on the other days
+    self.scrape_window = UpdateWindow(self.scrape_days, local=True)
+    self.schedule = FeedSchedule("avascrape",
+                                 windows=[self.scrape_window],
+                                 min_interval=900, interval=900,
+                                 max_interval=6 * 60 * 60)
     self.ready = False
     self.loop_task = None
 
@@ -28,10 +36,14 @@ class AvaScrape(Cog):
 
   async def looper(self):
     while True:
-      if datetime.today().weekday() in self.scrape_days:
-        self.bot.logger.info("Automatically scraping!")
-        await self.scrape()
-      await asyncio.sleep(900)
+      now = time.time()
+      if not self.scrape_window.contains(now):
+        await asyncio.sleep(self.scrape_window.next_start(now) - now)
+        continue
+      self.bot.logger.info("Automatically scraping!")
+      updated = await self.scrape()
+      now = time.time()
+      await asyncio.sleep(self.schedule.polled(now, updated) - now)
 
   @commands.command(alises=["scrape", "scr"])
   @commands.is_owner()
@@ -103,11 +115,12 @@ class AvaScrape(Cog):
     new_page_role = discord.utils.get(
       channel.guild.roles, id=cfg.new_page_role)
 
-    if new_page_role not in ctx.author.roles:
-      await ctx.author.add_roles(new_page_role, reason="Subscribed to page updates", atomic=True)
+    member = await fetch_member(channel.guild, ctx.author)
+    if new_page_role not in member.roles:
+      await member.add_roles(new_page_role, reason="Subscribed to page updates", atomic=True)
       subscribed = True
     else:
-      await ctx.author.remove_roles(new_page_role, reason="Unsubscribed from page updates", atomic=True)
+      await member.remove_roles(new_page_role, reason="Unsubscribed from page updates", atomic=True)
       subscribed = False
 
     action_message = "Subscribed to" if subscribed else "Unsubscribed from"
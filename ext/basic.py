@@ -16,7 +16,12 @@ class Basic(Cog):
     t2 = time.monotonic()
     rtt = (t2 - t1) * 1000
     ws = self.bot.latency * 1000
-    await m.edit(content=f"Pong! rtt: `{rtt:.1f}ms`, gateway: `{ws:.1f}ms`")
+    shard = ""
+    if ctx.guild and hasattr(self.bot, "latencies"):
+      # Sharded, so the latency of the shard this guild is on
+      ws = dict(self.bot.latencies).get(ctx.guild.shard_id, self.bot.latency) * 1000
+      shard = f" (shard {ctx.guild.shard_id})"
+    await m.edit(content=f"Pong! rtt: `{rtt:.1f}ms`, gateway: `{ws:.1f}ms`{shard}")
 
 
 def setup(bot):
@@ -1,4 +1,5 @@
 import aiohttp
+import discord
 import discord.ext.commands.cog
 
 
@@ -7,6 +8,13 @@ class Cog(discord.ext.commands.cog.Cog):
     self.bot = bot
 
 
+async def fetch_member(guild, user):
+  """user as a member of guild, asking Discord if they aren't cached (like with the lean gateway)"""
+  if isinstance(user, discord.Member) and user.guild == guild:
+    return user
+  return guild.get_member(user.id) or await guild.fetch_member(user.id)
+
+
 async def hastebin(session: aiohttp.ClientSession, text: str, extension: str="py") -> str:
   """ Pastes something to Hastebin, and returns the link to it. """
   async with session.post('https://hastebin.com/documents', data=text) as resp:
@@ -0,0 +1,202 @@
+import asyncio
+import collections
+import functools
+import itertools
+import time
+
+import discord
+
+from .metrics import Metrics
+from .tracing import Tracer
+
+
+class TokenBucket:
+  """Lets through at most rate calls every per seconds, waiting instead of failing"""
+
+  def __init__(self, rate, per):
+    self.rate = rate
+    self.per = per
+    self.tokens = rate
+    self.updated = time.monotonic()
+    self.lock = asyncio.Lock()
+
+  async def acquire(self):
+    """Takes a token, returning how long we had to wait for it"""
+    waited = 0
+    async with self.lock:
+      while True:
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate / self.per)
+        self.updated = now
+        if self.tokens >= 1:
+          self.tokens -= 1
+          return waited
+        delay = (1 - self.tokens) * self.per / self.rate
+        await asyncio.sleep(delay)
+        waited += delay
+
+
+class Dispatcher:
+  """Sends to lots of channels at once while staying under Discord's rate limits
+
+  Every REST call goes through a bucket for its route (keyed on the route's
+  major parameter, like Discord does) and the global bucket, so we slow down
+  before Discord has to tell us to with a 429. Jobs are interleaved between
+  guilds so one guild with lots of channels can't hog the front of the queue.
+  """
+
+  def __init__(self, concurrency=50, global_rate=(45, 1), message_rate=(5, 5), role_rate=(1, 1),
+               metrics=None, tracer=None):
+    self.metrics = metrics or Metrics()
+    self.tracer = tracer or Tracer()
+    self.semaphore = asyncio.Semaphore(concurrency)
+    self.global_bucket = TokenBucket(*global_rate)
+    self.rates = {
+      "messages": message_rate,
+      "roles": role_rate
+    }
+    self.buckets = {}
+    self.stats = {
+      "calls": 0,
+      "bucket_wait": 0.0,
+      "direct_pings": 0,
+      "role_toggles": 0
+    }
+
+  def bucket(self, route, key):
+    if (route, key) not in self.buckets:
+      # Buckets that are full again are as good as new, so drop them instead
+      # of keeping one around for every channel we've ever sent to
+      if len(self.buckets) > 10000:
+        self.buckets = {bucket_key: bucket for bucket_key, bucket in self.buckets.items()
+                        if bucket.tokens < bucket.rate}
+      self.buckets[(route, key)] = TokenBucket(*self.rates[route])
+    return self.buckets[(route, key)]
+
+  async def call(self, route, key, coro):
+    waited = await self.bucket(route, key).acquire()
+    waited += await self.global_bucket.acquire()
+    self.stats["calls"] += 1
+    self.stats["bucket_wait"] += waited
+    self.metrics.bucket_wait.inc(waited, route=route)
+    return await coro
+
+  async def send(self, channel, content, **kwargs):
+    return await self.call("messages", channel.id, channel.send(content, **kwargs))
+
+  async def edit_role(self, role, **kwargs):
+    return await self.call("roles", role.guild.id, role.edit(**kwargs))
+
+  def allowed_mentions(self, role=None):
+    # Only newer discord.py has mention overrides, older ones ping whatever
+    # the content mentions
+    if not hasattr(discord, "AllowedMentions"):
+      return {}
+    if role:
+      return {"allowed_mentions": discord.AllowedMentions(everyone=False, users=False, roles=[role])}
+    return {"allowed_mentions": discord.AllowedMentions.none()}
+
+  async def announce(self, deliveries, ping=True, reason="New panels!"):
+    """Sends a batch of announcements, pinging roles with as few REST calls as we can
+
+    deliveries are dicts with "channel", "role" (or None), "content" and
+    optionally "mention_format" (defaults to "{mention}: {content}"). If we're
+    allowed to mention everyone in a channel, the role gets pinged in one
+    request. Otherwise the role has to be made mentionable first, and each such
+    role is only toggled once for the whole batch, however many deliveries use it.
+    Each delivery ends up with "sent" set, or "error" if it failed.
+    """
+    jobs = []
+    toggled = collections.defaultdict(list)
+
+    async def deliver(delivery, mention=None, **kwargs):
+      # Outcomes are recorded on the delivery so callers can tell which ones made it
+      content = delivery["content"] if mention is None else \
+        delivery.get("mention_format", "{mention}: {content}").format(
+          mention=mention, content=delivery["content"])
+      try:
+        with self.tracer.span("deliver", cat="announce", channel=delivery["channel"].id):
+          await self.send(delivery["channel"], content, **kwargs)
+      except Exception as err:
+        delivery["error"] = err
+        raise
+      delivery["sent"] = True
+
+    for delivery in deliveries:
+      channel = delivery["channel"]
+      role = delivery["role"]
+      if not role:
+        jobs.append((channel.guild.id, functools.partial(deliver, delivery)))
+      elif not ping:
+        # Local bot, name the role without pinging anyone. Escaped, as 1.3 has
+        # no AllowedMentions and a role called "everyone" would ping everyone
+        jobs.append((channel.guild.id, functools.partial(
+          deliver, delivery, discord.utils.escape_mentions(f"@{role.name}"), **self.allowed_mentions())))
+      elif role.mentionable or channel.permissions_for(channel.guild.me).mention_everyone:
+        self.stats["direct_pings"] += 1
+        jobs.append((channel.guild.id, functools.partial(
+          deliver, delivery, role.mention, **self.allowed_mentions(role))))
+      else:
+        toggled[role].append(delivery)
+
+    async def toggle_and_send(role, role_deliveries):
+      self.stats["role_toggles"] += 1
+      try:
+        await self.edit_role(role, mentionable=True, reason=reason)
+      except discord.Forbidden:
+        pass
+      except Exception as err:
+        # None of them get sent, but each needs to know why
+        for delivery in role_deliveries:
+          delivery["error"] = err
+        raise
+      # Every send has to be done before the role goes back to unmentionable
+      results = await asyncio.gather(*[
+        deliver(delivery, role.mention, **self.allowed_mentions(role))
+        for delivery in role_deliveries
+      ], return_exceptions=True)
+      try:
+        await self.edit_role(role, mentionable=False, reason=reason)
+      except discord.Forbidden:
+        pass
+      for result in results:
+        if isinstance(result, Exception):
+          raise result
+
+    for role, role_deliveries in toggled.items():
+      jobs.append((role.guild.id, functools.partial(toggle_and_send, role, role_deliveries)))
+
+    return await self.run(jobs)
+
+  async def run(self, jobs):
+    """Runs (guild_id, coroutine function) jobs concurrently, fairly between guilds
+
+    Returns the total time taken and how long each job took to finish,
+    measured from when we started.
+    """
+    by_guild = collections.defaultdict(list)
+    for guild_id, job in jobs:
+      by_guild[guild_id].append(job)
+    # Round robin between guilds. The semaphore wakes waiters in order, so
+    # this is the order jobs actually get to go in
+    ordered = [job for round_ in itertools.zip_longest(*by_guild.values())
+               for job in round_ if job]
+
+    started = time.monotonic()
+    latencies = []
+
+    async def run_job(job):
+      async with self.semaphore:
+        try:
+          return await job()
+        finally:
+          latencies.append(time.monotonic() - started)
+
+    results = await asyncio.gather(*[run_job(job) for job in ordered], return_exceptions=True)
+    elapsed = time.monotonic() - started
+    self.metrics.announce_seconds.observe(elapsed)
+    return {
+      "elapsed": elapsed,
+      "latencies": sorted(latencies),
+      "errors": [result for result in results if isinstance(result, Exception)]
+    }
@@ -0,0 +1,234 @@
+import datetime
+import functools
+import json
+import math
+import re
+import time
+
+import dateutil.parser
+import lxml.etree
+import lxml.html
+from cssselect import HTMLTranslator
+
+from .feedparse import ItemParser
+from .parsepool import html_parser
+
+css_translator = HTMLTranslator()
+
+
+class BadPage(Exception):
+  pass
+
+
+def fill_template(templates, values):
+  """Fills in the first template we have every value for"""
+  if isinstance(templates, str):
+    templates = [templates]
+  present = {key: value for key, value in values.items() if value is not None}
+  for template in templates:
+    try:
+      return template.format_map(present)
+    except KeyError:
+      continue
+  return None
+
+
+class Field:
+  """A single field of an extractor spec, compiled
+
+  A field gets its value from exactly one source:
+    css       first element matching a selector (its "attr", or its text)
+    path      dotted path into a JSON document, e.g. "months.0.incidents.0.code"
+    item      a child of the RSS <item>
+    body      the whole response body
+    field     a field extracted before this one
+    template  a format string over the comic's keys and earlier fields
+    now       no date, the feed didn't give one. Left as None while
+              extracting, and filled in with the current time afterwards
+    first     a list of field specs, the first one that finds something wins
+  which can then be run through a "regex" (keeping group 1), decoded from
+  "hex" and converted to a "type" ("int" or "date", always UTC).
+  Extraction doesn't touch the bot, so it can run in a parse worker.
+  """
+
+  def __init__(self, name, spec):
+    self.name = name
+    self.optional = spec.get("optional", False)
+    self.alternatives = [Field(name, alternative) for alternative in spec.get("first", [])]
+    self.xpath = lxml.etree.XPath(css_translator.css_to_xpath(spec["css"])) if "css" in spec else None
+    self.attr = spec.get("attr")
+    self.path = [int(part) if part.isdigit() else part
+                 for part in spec["path"].split(".")] if "path" in spec else None
+    self.item = spec.get("item")
+    self.body = spec.get("body", False)
+    self.field = spec.get("field")
+    self.template = spec.get("template")
+    # Also set when one of its alternatives is, it can then always fall back to now
+    self.now = spec.get("now", False) or any(alternative.now for alternative in self.alternatives)
+    self.regex = re.compile(spec["regex"]) if "regex" in spec else None
+    self.decode = spec.get("decode")
+    self.type = spec.get("type")
+
+  def source(self, doc, values):
+    if self.xpath is not None:
+      found = self.xpath(doc)
+      if not found:
+        return None
+      if self.attr:
+        return found[0].get(self.attr)
+      return "".join(found[0].itertext()).strip()
+    if self.path is not None:
+      try:
+        for part in self.path:
+          doc = doc[part]
+      except (KeyError, IndexError, TypeError):
+        return None
+      return doc
+    if self.item:
+      return doc.get(self.item)
+    if self.body:
+      return doc
+    if self.field:
+      return values.get(self.field)
+    if self.template:
+      return fill_template(self.template, values)
+    return None
+
+  def extract(self, doc, values):
+    if self.alternatives:
+      for alternative in self.alternatives:
+        value = alternative.extract(doc, values)
+        if value is not None:
+          return value
+      return None
+
+    value = self.source(doc, values)
+    if value is None:
+      return None
+    if self.regex:
+      match = self.regex.search(str(value))
+      if not match:
+        return None
+      value = match.group(1)
+    if self.decode == "hex":
+      value = "".join(chr(int(value[i:i + 2], 16)) for i in range(0, len(value), 2))
+    return self.convert(value)
+
+  def convert(self, value):
+    if self.type == "int":
+      try:
+        return int(value)
+      except ValueError:
+        raise BadPage(f"{self.name} isn't a number: '{value}'")
+    if self.type == "date":
+      parsed = dateutil.parser.parse(str(value))
+      if not parsed.tzinfo:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+      return parsed.astimezone(datetime.timezone.utc)
+    return value
+
+
+class Extractor:
+  """A scraper built from a declarative spec, compiled once when it's defined
+
+  spec looks like:
+    {
+      "format": "rss" | "html" | "json" | "text",
+      "url": "{rss_url}",  # Template over the comic's keys (and "timestamp"),
+                           # or a list of them to try in order
+      "fields": {...}  # See Field. "id", "url" and "title" are required,
+                       # "time" defaults to now. Fields are extracted in
+                       # order so later ones can use earlier ones
+    }
+  Extractors are called like any other check_updates hook. Fetching happens
+  on the loop, parsing and extraction in the bot's parse pool. They pickle as
+  their spec, so process workers compile each one once and reuse it.
+  """
+
+  formats = ("rss", "html", "json", "text")
+  required = ("id", "url", "title")
+
+  def __init__(self, spec):
+    self.spec = spec
+    self.format = spec["format"]
+    if self.format not in self.formats:
+      raise ValueError(f"Unknown extractor format: {self.format}")
+    self.url = spec["url"]
+    self.headers = spec.get("headers", {})
+    self.fields = [Field(name, field) for name, field in spec["fields"].items()]
+    missing = [name for name in self.required if name not in spec["fields"]]
+    if missing:
+      raise ValueError(f"Extractor is missing fields: {', '.join(missing)}")
+    # The only parts of an RSS item we need to keep
+    self.item_fields = tuple(sorted(self._item_names(self.fields)))
+
+  def __reduce__(self):
+    # Fields are extracted in order, which JSON keeps
+    return compiled_extractor, (json.dumps(self.spec),)
+
+  def _item_names(self, fields):
+    for field in fields:
+      if field.item:
+        yield field.item
+      yield from self._item_names(field.alternatives)
+
+  async def fetch(self, comic, bot):
+    url = fill_template(self.url, {**comic, "timestamp": math.floor(time.time())})
+    if self.format == "rss":
+      resp = await bot.fetcher.stream(url, ItemParser(fields=self.item_fields, encoding="utf-8"),
+                                      headers=self.headers, cache_key=comic["slug"],
+                                      pool=bot.parse_pool)
+    else:
+      resp = await bot.fetcher.request(url, self.headers, cache_key=comic["slug"])
+    if resp["resp"].status != 200:
+      raise BadPage("Non-200 status code: " + str(resp["resp"].status))
+
+    if self.format == "rss":
+      if not resp["result"]:
+        raise BadPage("No items in feed")
+      return resp["result"][0]
+    return resp["text"]
+
+  def parse(self, body):
+    if self.format == "html":
+      return lxml.html.fromstring(body, parser=html_parser())
+    if self.format == "json":
+      return json.loads(body)
+    if self.format == "text":
+      return body.decode()
+    return body  # RSS items were already parsed while streaming
+
+  def extract(self, body, comic):
+    doc = self.parse(body)
+    values = dict(comic)
+    for field in self.fields:
+      value = field.extract(doc, values)
+      if value is None and not (field.optional or field.now):
+        raise BadPage(f"Couldn't find {field.name}")
+      values[field.name] = value
+    return {
+      "latest_post": {
+        "unique_id": values["id"],
+        "url": values["url"],
+        "title": values["title"],
+        "time": values.get("time"),
+        # Only a date the feed gave us, for measuring how long announcing took
+        "published": values.get("time")
+      }
+    }
+
+  async def __call__(self, comic, bot):
+    with bot.tracer.span("fetch", cat="fetch", url=self.spec.get("url")):
+      body = await self.fetch(comic, bot)
+    # Only the comic's own keys, the hook itself has no business in a worker
+    comic = {key: value for key, value in comic.items() if key != "check_updates"}
+    with bot.tracer.span("parse", cat="parse", mode=bot.parse_pool.mode):
+      results = await bot.parse_pool.run(self.extract, body, comic)
+    if results["latest_post"]["time"] is None:
+      results["latest_post"]["time"] = bot.r.now()
+    return results
+
+
+@functools.lru_cache(maxsize=None)
+def compiled_extractor(spec):
+  return Extractor(json.loads(spec))
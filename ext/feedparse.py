@@ -0,0 +1,44 @@
+import lxml.etree
+
+
+class ItemParser:
+  """Incrementally parses an RSS feed, stopping as soon as we have enough items
+
+  Chunks from the network are fed straight into an lxml pull parser, so we
+  never hold the whole body or build a tree for the parts of the feed we don't
+  care about. feed() returns None until it's done, then the list of items.
+  """
+
+  def __init__(self, fields=("title", "link", "pubDate"), limit=1, stop=None, encoding=None):
+    self.fields = fields
+    self.limit = limit  # Stop after this many items (None for no limit)
+    self.stop = stop  # Or once this returns True for an item
+    self.encoding = encoding
+    self.items = []
+    self.parser = None
+
+  def pull_parser(self):
+    # Made on first use, so it lives on whichever thread feeds it
+    if self.parser is None:
+      self.parser = lxml.etree.XMLPullParser(events=("end",), tag="item", encoding=self.encoding)
+    return self.parser
+
+  def feed(self, chunk):
+    self.pull_parser().feed(chunk)
+    return self._collect()
+
+  def close(self):
+    """Called if we run out of body before finding enough items"""
+    self.pull_parser().close()
+    self._collect()
+    return self.items
+
+  def _collect(self):
+    for _, element in self.parser.read_events():
+      item = {field: element.findtext(field) for field in self.fields}
+      # We've got what we need from it, don't let the tree grow
+      element.clear()
+      self.items.append(item)
+      if (self.limit and len(self.items) >= self.limit) or (self.stop and self.stop(item)):
+        return self.items
+    return None
@@ -0,0 +1,230 @@
+import hashlib
+import time
+import urllib.parse
+
+import aiohttp
+
+from .metrics import Metrics
+
+
+class NotModified(Exception):
+  """The resource hasn't changed since the last time we processed it"""
+  pass
+
+
+class BodyTooLarge(Exception):
+  """The response body went over the size limit"""
+  pass
+
+
+class ValidatorStore:
+  """Remembers ETag/Last-Modified and a hash of the last body for each feed
+
+  Validators are only staged when a response comes in. They're committed once
+  the caller has actually processed the body, so a fetch that fails halfway
+  gets another go next time instead of being skipped as unchanged.
+  """
+
+  def __init__(self, cache):
+    self.cache = cache
+    self.pending = {}
+
+  def conditional_headers(self, key):
+    entry = self.cache.get(key) or {}
+    headers = {}
+    if entry.get("etag"):
+      headers["If-None-Match"] = entry["etag"]
+    if entry.get("last_modified"):
+      headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
+
+  def unchanged(self, key, body_hash):
+    entry = self.cache.get(key)
+    return entry is not None and entry.get("hash") == body_hash
+
+  def stage(self, key, headers, body_hash):
+    self.pending[key] = {
+      "id": key,
+      "etag": headers.get("ETag"),
+      "last_modified": headers.get("Last-Modified"),
+      "hash": body_hash
+    }
+
+  def commit(self, key):
+    entry = self.pending.pop(key, None)
+    if entry:
+      self.cache.put(entry)
+
+
+class Fetcher:
+  """One long-lived HTTP client for everything that talks to the outside world
+
+  Keeps connections alive between polls, caches DNS lookups and caps how many
+  connections we hold open per host. Connection reuse is counted so we can
+  tell whether keep-alive is actually doing anything.
+  """
+
+  def __init__(self, loop=None, limit=100, limit_per_host=4, dns_ttl=300,
+               keepalive_timeout=60, timeout=30, max_body_size=8 * 1024 * 1024, metrics=None):
+    self.max_body_size = max_body_size
+    self.metrics = metrics or Metrics()
+    self.stats = {
+      "requests": 0,
+      "connections_created": 0,
+      "connections_reused": 0,
+      "dns_cache_hits": 0,
+      "dns_cache_misses": 0,
+      "not_modified": 0,
+      "unchanged_bodies": 0
+    }
+    # Set to a ValidatorStore to make requests with a cache_key conditional
+    self.validators = None
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(self._count("requests"))
+    trace_config.on_connection_create_end.append(self._count("connections_created"))
+    trace_config.on_connection_reuseconn.append(self._count("connections_reused"))
+    trace_config.on_dns_cache_hit.append(self._count("dns_cache_hits"))
+    trace_config.on_dns_cache_miss.append(self._count("dns_cache_misses"))
+
+    connector = aiohttp.TCPConnector(
+      limit=limit,
+      limit_per_host=limit_per_host,
+      use_dns_cache=True,
+      ttl_dns_cache=dns_ttl,
+      keepalive_timeout=keepalive_timeout,
+      loop=loop)
+    self.session = aiohttp.ClientSession(
+      connector=connector,
+      timeout=aiohttp.ClientTimeout(total=timeout),
+      trace_configs=[trace_config],
+      loop=loop)
+
+  def _count(self, stat):
+    async def on_event(session, trace_config_ctx, params):
+      self.stats[stat] += 1
+    return on_event
+
+  async def request(self, url, headers={}, body=None, cache_key=None):
+    """Makes a request, raising NotModified if cache_key's content hasn't changed"""
+    store = self.validators if cache_key else None
+    if store:
+      headers = {**headers, **store.conditional_headers(cache_key)}
+
+    feed = cache_key or urllib.parse.urlsplit(url).hostname
+    started = time.perf_counter()
+    status = "error"
+    try:
+      chosen_req = self.session.post if body else self.session.get
+      async with chosen_req(url, headers=headers, data=body) as resp:
+        status = str(resp.status)
+        if store and resp.status == 304:
+          self.stats["not_modified"] += 1
+          raise NotModified(url)
+        text = await self.read(url, resp)
+        self.metrics.fetch_bytes.inc(len(text), feed=feed)
+        if store and resp.status == 200:
+          # Plenty of servers don't bother with validators, so fall back to
+          # comparing the body itself
+          body_hash = hashlib.sha1(text).hexdigest()
+          if store.unchanged(cache_key, body_hash):
+            self.stats["unchanged_bodies"] += 1
+            raise NotModified(url)
+          store.stage(cache_key, resp.headers, body_hash)
+        return {
+          "text": text,
+          "resp": resp
+        }
+    finally:
+      self.metrics.fetch_seconds.observe(time.perf_counter() - started, feed=feed, status=status)
+
+  def check_length(self, url, resp):
+    # Turned away before reading anything, if the server says how big it is
+    if resp.content_length and resp.content_length > self.max_body_size:
+      raise BodyTooLarge(f"{url} is over {self.max_body_size} bytes")
+
+  async def read(self, url, resp, chunk_size=64 * 1024):
+    """The whole body, raising BodyTooLarge once it goes over max_body_size"""
+    self.check_length(url, resp)
+    chunks = []
+    size = 0
+    async for chunk in resp.content.iter_chunked(chunk_size):
+      size += len(chunk)
+      if size > self.max_body_size:
+        raise BodyTooLarge(f"{url} is over {self.max_body_size} bytes")
+      chunks.append(chunk)
+    return b"".join(chunks)
+
+  async def stream(self, url, parser, headers={}, cache_key=None, chunk_size=16 * 1024, pool=None):
+    """Feeds the body to parser chunk by chunk, stopping once it has a result
+
+    parser needs feed(chunk), returning None until it's got what it wants, and
+    close() for when the body runs out first. Returns the response and the
+    parser's result (None for non-200 responses, whose body is never read).
+    Given a ParsePool, the parser is fed in one of its lanes instead of on
+    the loop, always the same thread for the one parser.
+    """
+    store = self.validators if cache_key else None
+    if store:
+      headers = {**headers, **store.conditional_headers(cache_key)}
+
+    feed = cache_key or urllib.parse.urlsplit(url).hostname
+    started = time.perf_counter()
+    status = "error"
+    try:
+      async with self.session.get(url, headers=headers) as resp:
+        status = str(resp.status)
+        if store and resp.status == 304:
+          self.stats["not_modified"] += 1
+          raise NotModified(url)
+        if resp.status != 200:
+          return {"resp": resp, "result": None}
+
+        self.check_length(url, resp)
+        digest = hashlib.sha1()
+        size = 0
+        result = None
+        lane = pool.lane() if pool else None
+        async for chunk in resp.content.iter_chunked(chunk_size):
+          size += len(chunk)
+          if size > self.max_body_size:
+            raise BodyTooLarge(f"{url} is over {self.max_body_size} bytes")
+          digest.update(chunk)
+          result = await lane.run(parser.feed, chunk) if lane else parser.feed(chunk)
+          if result is not None:
+            break
+        else:
+          result = await lane.run(parser.close) if lane else parser.close()
+
+        self.metrics.fetch_bytes.inc(size, feed=feed)
+        # If there isn't much left, read it anyway so the connection can be
+        # reused. Otherwise it's cheaper to just drop the connection
+        if resp.content_length and resp.content_length - size <= chunk_size * 4:
+          await resp.content.read()
+
+        # The hash only covers what we read, but that's everything we
+        # extracted from, so it works just as well for spotting changes
+        if store:
+          body_hash = digest.hexdigest()
+          if store.unchanged(cache_key, body_hash):
+            self.stats["unchanged_bodies"] += 1
+            raise NotModified(url)
+          store.stage(cache_key, resp.headers, body_hash)
+        return {"resp": resp, "result": result}
+    finally:
+      self.metrics.fetch_seconds.observe(time.perf_counter() - started, feed=feed, status=status)
+
+  def reuse_ratio(self):
+    connections = self.stats["connections_created"] + self.stats["connections_reused"]
+    return self.stats["connections_reused"] / connections if connections else 0.0
+
+  def format_stats(self):
+    return (f'{self.stats["requests"]} requests, '
+            f'{self.stats["connections_created"]} new connections, '
+            f'{self.stats["connections_reused"]} reused ({self.reuse_ratio():.0%}), '
+            f'DNS cache {self.stats["dns_cache_hits"]} hits/{self.stats["dns_cache_misses"]} misses, '
+            f'{self.stats["not_modified"]} not modified, '
+            f'{self.stats["unchanged_bodies"]} unchanged bodies')
+
+  async def close(self):
+    await self.session.close()
@@ -0,0 +1,52 @@
+from .memdiag import rss
+
+# Client options for lean mode. All we need from the gateway is guilds,
+# channels, roles and the member running a command, who comes with the message
+lean_options = {
+  "fetch_offline_members": False,  # No member chunking for large guilds
+  "guild_subscriptions": False,  # No presence, typing or member list events
+  "max_messages": None  # Nothing reads the message cache
+}
+
+# Anything Discord sends anyway that we have no use for
+dropped_events = ("PRESENCE_UPDATE", "TYPING_START")
+
+
+def make_lean(state):
+  """Stops a connection state caching members, on top of lean_options
+
+  Small guilds still come with every member in GUILD_CREATE, so those get
+  trimmed down to just us before discord.py ever sees them.
+  """
+  parse_guild_create = state.parsers["GUILD_CREATE"]
+
+  def guild_create(data):
+    me = str(state.self_id)
+    data["members"] = [member for member in data.get("members", []) if member["user"]["id"] == me]
+    data["presences"] = []
+    parse_guild_create(data)
+
+  state.parsers["GUILD_CREATE"] = guild_create
+  for event in dropped_events:
+    state.parsers[event] = lambda data: None
+
+
+def footprint(bot):
+  """What the gateway connection is costing us right now"""
+  return {
+    "mode": "lean" if bot.lean else "full",
+    "ready_after": bot.ready_after,
+    "rss": rss(),
+    "guilds": len(bot.guilds),
+    "members": sum(len(guild.members) for guild in bot.guilds),
+    "users": len(bot.users),
+    "messages": len(bot.cached_messages)
+  }
+
+
+def format_footprint(stats):
+  ready = f"ready after {stats['ready_after']:.1f}s" if stats["ready_after"] is not None \
+    else "not ready yet"
+  memory = f"{stats['rss'] / 1024 / 1024:.0f} MiB RSS" if stats["rss"] else "RSS unknown"
+  return (f"{stats['mode']} gateway, {ready}, {memory}, {stats['guilds']} guilds, "
+          f"{stats['members']} members/{stats['users']} users/{stats['messages']} messages cached")
@@ -0,0 +1,149 @@
+import asyncio
+import hashlib
+import os
+import socket
+import time
+import uuid
+
+from .state import ensure_table
+
+
+def rank(member, key):
+  return hashlib.sha1(f"{member}\0{key}".encode()).digest()
+
+
+class LeaseManager:
+  """Splits a set of keys (feeds) between processes with leases in the database
+
+  Every process heartbeats into the pollers table. Each key belongs to
+  whichever live poller ranks highest for it (rendezvous hashing), so when
+  one joins or dies only its share of keys moves. Owning a key means holding
+  its row in the leases table, which expires ttl seconds after it was last
+  renewed. A lease is only ever taken over once it's expired or let go, and
+  we stop treating a key as ours once our own lease on it could have
+  expired, so a key never has two owners at once. Handing a key over leaves
+  it unowned for up to renew_interval seconds.
+  """
+
+  def __init__(self, bot, keys, on_acquire, on_release, ttl=30, renew_interval=10, name=None):
+    self.bot = bot
+    self.keys = list(keys)
+    self.on_acquire = on_acquire  # Coroutine function, called with a list of newly owned keys
+    self.on_release = on_release  # Called with a list of keys we no longer own
+    self.ttl = ttl
+    self.renew_interval = renew_interval
+    self.name = name or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+    self.owned = set()
+    self.valid_until = 0  # time.monotonic() our leases are good until
+    self.members = [self.name]
+    self.task = None
+
+  def start(self):
+    self.task = self.bot.loop.create_task(self.run())
+
+  def stop(self):
+    if self.task:
+      self.task.cancel()
+
+  def owns(self, key):
+    return key in self.owned and time.monotonic() < self.valid_until
+
+  def owner_of(self, key, members):
+    return max(members, key=lambda member: rank(member, key))
+
+  async def setup(self):
+    await ensure_table(self.bot, "pollers")
+    await ensure_table(self.bot, "leases")
+
+  async def run(self):
+    await self.bot.db_connect_task
+    await self.setup()
+    while True:
+      try:
+        await self.renew()
+      except asyncio.CancelledError:
+        raise
+      except Exception as err:
+        self.bot.logger.error(f"Failed to renew feed leases: {err}")
+        if self.owned and time.monotonic() >= self.valid_until:
+          self.bot.logger.warning(f"Leases on {len(self.owned)} feeds lapsed, stopping them")
+          self.lose(self.owned)
+      await asyncio.sleep(self.renew_interval)
+
+  async def renew(self):
+    r = self.bot.r
+    conn = self.bot.r_connection
+    me = self.name
+    # Server time for everything stored, so clocks on different nodes don't matter
+    now = r.now().to_epoch_time()
+    started = time.monotonic()
+
+    await r.table("pollers").insert(
+      {"id": me, "expires": now + self.ttl}, conflict="replace").run(conn)
+    members = await r.table("pollers").filter(r.row["expires"] > now)["id"] \
+      .coerce_to("array").run(conn)
+    if me not in members:
+      members.append(me)
+    if sorted(members) != sorted(self.members):
+      self.bot.logger.info(f"{len(members)} pollers now, rebalancing feeds")
+    self.members = members
+
+    targets = {key for key in self.keys if self.owner_of(key, members) == me}
+    letting_go = [key for key in self.owned if key not in targets]
+    if letting_go:
+      # Stop first, then give the lease up for the new owner to pick up
+      self.lose(letting_go)
+      await r.table("leases").get_all(*letting_go).filter({"owner": me}).delete().run(conn)
+
+    owned = set()
+    if targets:
+      # Takes free and expired leases and renews our own. Leases someone else
+      # still holds are left alone, they'll let go once they notice us
+      await r.table("leases").insert(
+        [{"id": key, "owner": me, "expires": now + self.ttl} for key in targets],
+        conflict=lambda key, old, new: r.branch(
+          old["owner"].eq(me).or_(old["expires"].lt(now)), new, old)
+      ).run(conn)
+      owned = set(await r.table("leases").get_all(*targets).filter({"owner": me})["id"]
+                  .coerce_to("array").run(conn))
+    self.valid_until = started + self.ttl
+
+    lost = self.owned - owned
+    if lost:
+      self.lose(lost)
+    gained = owned - self.owned
+    if gained:
+      # Only ours once they're set up. If that fails we still hold the leases,
+      # so the next renew finds them gained again and retries
+      await self.on_acquire(sorted(gained))
+      self.owned |= gained
+    self.bot.metrics.leased_feeds.set(len(self.owned))
+    if gained or letting_go or lost:
+      self.bot.logger.info(f"Polling {len(self.owned)}/{len(self.keys)} feeds "
+                           f"({len(gained)} taken on, {len(letting_go) + len(lost)} given up)")
+
+    # Tidy up after pollers that died a while ago
+    await r.table("pollers").filter(r.row["expires"] < now - 10 * self.ttl).delete().run(conn)
+
+  def lose(self, keys):
+    keys = list(keys)
+    self.owned.difference_update(keys)
+    self.on_release(keys)
+
+  async def leave(self):
+    """Gives everything up straight away, so the others don't wait for us to expire
+
+    Call it after stop(), on the way out.
+    """
+    r = self.bot.r
+    try:
+      conn = self.bot.r_connection
+      await r.table("leases").filter({"owner": self.name}).delete().run(conn)
+      await r.table("pollers").get(self.name).delete().run(conn)
+    except Exception as err:
+      self.bot.logger.error(f"Failed to give up feed leases: {err}")
+    self.lose(self.owned)
+
+  def format_stats(self):
+    return (f"Poller {self.name}: {len(self.owned)}/{len(self.keys)} feeds, "
+            f"{len(self.members)} pollers")
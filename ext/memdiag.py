@@ -0,0 +1,130 @@
+import asyncio
+import collections
+import os
+import time
+import tracemalloc
+
+ignored = (
+  tracemalloc.Filter(False, tracemalloc.__file__),
+  tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+  tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+  tracemalloc.Filter(False, "<unknown>")
+)
+
+
+def rss():
+  """Resident memory in bytes, or None if we can't tell"""
+  try:
+    with open("/proc/self/statm") as statm:
+      return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+  except (OSError, ValueError):
+    return None
+
+
+def format_size(size):
+  for unit in ("B", "KiB", "MiB"):
+    if abs(size) < 1024:
+      return f"{size:+.1f} {unit}"
+    size /= 1024
+  return f"{size:+.1f} GiB"
+
+
+class MemoryDiagnostics:
+  """Looks for allocation sites that keep growing from one poll cycle to the next
+
+  A session turns tracemalloc on, snapshots memory at the end of each cycle
+  and diffs it against the previous one. Sites that grew in every diff are
+  reported. Tracing slows every allocation down, so it's only on during a
+  session. Background sessions are at least interval seconds apart, and
+  spaced out further if needed so no more than budget of the time is spent
+  tracing. Only Python allocations are traced. If RSS grows much more than
+  what's traced, the growth is native, like libxml2 trees or SSL buffers.
+  """
+
+  def __init__(self, bot, interval=None, cycles=3, budget=0.05, frames=8, top=10):
+    self.bot = bot
+    self.interval = interval  # None for on demand only
+    self.cycles = cycles
+    self.budget = budget
+    self.frames = frames
+    self.top = top
+    self.session = None
+    self.last_report = None
+    self.next_session = time.monotonic() + interval if interval else None
+
+  def snapshot(self):
+    return tracemalloc.take_snapshot().filter_traces(ignored)
+
+  def begin(self, cycles=None):
+    """Starts a session covering the next few cycles, or returns the one going"""
+    if self.session:
+      return self.session
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+      tracemalloc.start(self.frames)
+    self.session = {
+      "started": time.monotonic(),
+      "cycles": cycles or self.cycles,
+      "diffs": 0,
+      "growth": collections.defaultdict(list),  # Traceback -> [(size, count) per diff]
+      "tracebacks": {},
+      "snapshot": self.snapshot(),
+      "first_snapshot": None,
+      "rss": rss(),
+      "started_tracing": started_tracing,
+      "done": asyncio.Event()
+    }
+    self.session["first_snapshot"] = self.session["snapshot"]
+    return self.session
+
+  def cycle_finished(self):
+    """Called at the end of every poll cycle"""
+    if self.session is None:
+      if self.next_session is not None and time.monotonic() >= self.next_session:
+        self.begin()
+      return
+    session = self.session
+    snapshot = self.snapshot()
+    for stat in snapshot.compare_to(session["snapshot"], "traceback"):
+      if stat.size_diff:
+        session["growth"][stat.traceback].append((stat.size_diff, stat.count_diff))
+    session["snapshot"] = snapshot
+    session["diffs"] += 1
+    if session["diffs"] >= session["cycles"]:
+      self.finish()
+
+  def finish(self):
+    session = self.session
+    report = self.report(session)
+    if session["started_tracing"]:
+      tracemalloc.stop()
+    now = time.monotonic()
+    if self.interval:
+      # Off for long enough that tracing stays within budget
+      traced_for = now - session["started"]
+      self.next_session = now + max(self.interval, traced_for * (1 / self.budget - 1))
+    self.session = None
+    self.last_report = report
+    self.bot.logger.info(report)
+    session["done"].set()
+
+  def report(self, session):
+    elapsed = time.monotonic() - session["started"]
+    total = sum(stat.size_diff for stat in session["snapshot"].compare_to(session["first_snapshot"], "filename"))
+    rss_now = rss()
+    lines = [f"Memory over {session['diffs']} cycles ({elapsed:.0f}s): traced {format_size(total)}"
+             + (f", RSS {format_size(rss_now - session['rss'])}" if rss_now and session["rss"] else "")]
+
+    # Only what grew every single time, a one-off spike isn't a leak
+    growers = [
+      (sum(size for size, _ in diffs), sum(count for _, count in diffs), traceback)
+      for traceback, diffs in session["growth"].items()
+      if len(diffs) == session["diffs"] and all(size > 0 for size, _ in diffs)
+    ]
+    growers.sort(key=lambda grower: grower[0], reverse=True)
+    if not growers:
+      lines.append("Nothing grew every cycle")
+    for size, count, traceback in growers[:self.top]:
+      lines.append(f"{format_size(size)} in {count:+d} blocks:")
+      lines.extend("    " + line.strip() for line in traceback.format(most_recent_first=True)[:6] if line.strip())
+    return "\n".join(lines)
@@ -0,0 +1,240 @@
+import bisect
+import collections
+import logging
+import time
+
+from aiohttp import web
+from rethinkdb import ast
+
+# Seconds, from a fast DB query up to a feed that takes its sweet time
+default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def escape(value):
+  return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names, values):
+  if not names:
+    return ""
+  return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class Counter:
+  kind = "counter"
+
+  def __init__(self, name, help, labels=()):
+    self.name = name
+    self.help = help
+    self.labels = tuple(labels)
+    self.values = collections.defaultdict(float)
+
+  def key(self, labels):
+    return tuple(labels.get(name, "") for name in self.labels)
+
+  def inc(self, amount=1, **labels):
+    self.values[self.key(labels)] += amount
+
+  def samples(self):
+    for key, value in self.values.items():
+      yield self.name, format_labels(self.labels, key), value
+
+
+class Gauge(Counter):
+  kind = "gauge"
+
+  def set(self, value, **labels):
+    self.values[self.key(labels)] = value
+
+
+class Histogram(Counter):
+  kind = "histogram"
+
+  def __init__(self, name, help, labels=(), buckets=default_buckets):
+    super().__init__(name, help, labels)
+    self.buckets = tuple(buckets)
+    self.values = {}  # label values -> [bucket counts..., +Inf count, sum, count]
+
+  def observe(self, value, **labels):
+    key = self.key(labels)
+    if key not in self.values:
+      self.values[key] = [0] * (len(self.buckets) + 3)
+    counts = self.values[key]
+    # Counts are per bucket here and only made cumulative when rendered
+    counts[bisect.bisect_left(self.buckets, value)] += 1
+    counts[-2] += value
+    counts[-1] += 1
+
+  def time(self, **labels):
+    return Timer(self, labels)
+
+  def samples(self):
+    names = self.labels + ("le",)
+    for key, counts in self.values.items():
+      total = 0
+      for bound, count in zip(self.buckets + ("+Inf",), counts):
+        total += count
+        yield f"{self.name}_bucket", format_labels(names, key + (bound,)), total
+      yield f"{self.name}_sum", format_labels(self.labels, key), counts[-2]
+      yield f"{self.name}_count", format_labels(self.labels, key), counts[-1]
+
+
+class Timer:
+  def __init__(self, histogram, labels):
+    self.histogram = histogram
+    self.labels = labels
+
+  def __enter__(self):
+    self.started = time.perf_counter()
+    return self
+
+  def __exit__(self, *exc):
+    self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+
+def query_table(term):
+  """Name of the first table a ReQL query touches"""
+  stack = [term]
+  while stack:
+    term = stack.pop()
+    if isinstance(term, ast.Table):
+      return getattr(term._args[0], "data", "?")
+    stack.extend(getattr(term, "_args", ()))
+    stack.extend(getattr(term, "optargs", {}).values())
+  return "none"
+
+
+class TimedConnection:
+  """Wraps a RethinkDB connection to time every query by table
+
+  Every query.run(connection) goes through the connection's _start, so this
+  is the one place all of them can be seen. Everything else is passed through.
+  """
+
+  def __init__(self, connection, metrics, tracer=None):
+    self.connection = connection
+    self.metrics = metrics
+    self.tracer = tracer
+
+  def __getattr__(self, name):
+    return getattr(self.connection, name)
+
+  def _start(self, term, **global_optargs):
+    return self._timed(query_table(term), self.connection._start(term, **global_optargs))
+
+  async def _timed(self, table, query):
+    started = time.perf_counter()
+    status = "ok"
+    try:
+      if self.tracer:
+        with self.tracer.span(f"db {table}", cat="db", table=table):
+          return await query
+      return await query
+    except Exception:
+      status = "error"
+      raise
+    finally:
+      self.metrics.db_seconds.observe(time.perf_counter() - started, table=table, status=status)
+
+
+class RateLimitCounter(logging.Handler):
+  """Counts the 429s discord.py retries on its own, which it only ever logs"""
+
+  def __init__(self, metrics):
+    super().__init__(logging.WARNING)
+    self.metrics = metrics
+
+  def emit(self, record):
+    message = record.getMessage()
+    if message.startswith("We are being rate limited"):
+      self.metrics.discord_429s.inc(scope="route")
+    elif message.startswith("Global rate limit"):
+      self.metrics.discord_429s.inc(scope="global")
+
+
+class Metrics:
+  """Everything we measure, served in Prometheus' text format on /metrics"""
+
+  def __init__(self):
+    self.registry = []
+    self.fetch_seconds = self.histogram(
+      "avabot_fetch_seconds", "Time to fetch a feed, until its body was read", ["feed", "status"])
+    self.fetch_bytes = self.counter(
+      "avabot_fetch_bytes_total", "Response body bytes read", ["feed"])
+    self.parse_seconds = self.histogram(
+      "avabot_parse_seconds", "Time spent parsing and extracting", ["where"])
+    self.db_seconds = self.histogram(
+      "avabot_db_seconds", "RethinkDB query latency", ["table", "status"])
+    self.announce_seconds = self.histogram(
+      "avabot_announce_seconds", "Time to fan a batch of announcements out")
+    self.bucket_wait = self.counter(
+      "avabot_bucket_wait_seconds_total", "Time spent waiting on our own rate limit buckets", ["route"])
+    self.discord_429s = self.counter(
+      "avabot_discord_429_total", "Rate limited responses from Discord", ["scope"])
+    self.detect_to_announce = self.histogram(
+      "avabot_detect_to_announce_seconds", "Time from spotting a new post to announcing it",
+      buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600))
+    self.publish_to_announce = self.histogram(
+      "avabot_publish_to_announce_seconds", "Time from a post's publish date to announcing it",
+      buckets=(60, 120, 300, 600, 900, 1800, 3600, 2 * 3600, 6 * 3600, 24 * 3600))
+    self.command_seconds = self.histogram(
+      "avabot_command_seconds", "Command latency", ["command", "status"])
+    self.messages = self.counter(
+      "avabot_messages_total", "Messages seen, by whether they went on to command handling",
+      ["outcome"])
+    self.cycle_seconds = self.histogram(
+      "avabot_cycle_seconds", "Time to check a batch of due feeds",
+      buckets=(1, 2.5, 5, 10, 30, 60, 120, 300, 600))
+    self.loop_lag = self.histogram(
+      "avabot_loop_lag_seconds", "How late the event loop got round to a timer",
+      buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+    self.leased_feeds = self.gauge(
+      "avabot_leased_feeds", "Feeds this poller holds the lease on")
+    self.loop_stalls = self.counter(
+      "avabot_loop_stalls_total", "Times something blocked the event loop past the threshold", ["cog"])
+    self.startup_seconds = self.gauge(
+      "avabot_startup_seconds", "Time from starting up to the gateway being ready", ["mode"])
+    self.rss_bytes = self.gauge(
+      "avabot_rss_bytes", "Resident memory", ["mode"])
+    self.cached_members = self.gauge(
+      "avabot_cached_members", "Members in discord.py's cache", ["mode"])
+    self.collectors = []  # Called before rendering, for gauges read off something else
+    self.runner = None
+
+  def counter(self, name, help, labels=()):
+    return self.add(Counter(name, help, labels))
+
+  def gauge(self, name, help, labels=()):
+    return self.add(Gauge(name, help, labels))
+
+  def histogram(self, name, help, labels=(), buckets=default_buckets):
+    return self.add(Histogram(name, help, labels, buckets))
+
+  def add(self, metric):
+    self.registry.append(metric)
+    return metric
+
+  def render(self):
+    for collect in self.collectors:
+      collect()
+    lines = []
+    for metric in self.registry:
+      lines.append(f"# HELP {metric.name} {metric.help}")
+      lines.append(f"# TYPE {metric.name} {metric.kind}")
+      for name, labels, value in metric.samples():
+        lines.append(f"{name}{labels} {value}")
+    return "\n".join(lines) + "\n"
+
+  async def handle(self, request):
+    return web.Response(text=self.render(), content_type="text/plain", charset="utf-8")
+
+  async def serve(self, host="127.0.0.1", port=9184):
+    app = web.Application()
+    app.router.add_get("/metrics", self.handle)
+    self.runner = web.AppRunner(app, access_log=None)
+    await self.runner.setup()
+    await web.TCPSite(self.runner, host, port).start()
+
+  async def close(self):
+    if self.runner:
+      await self.runner.cleanup()
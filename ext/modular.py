@@ -4,186 +4,143 @@
 
 
 import asyncio
-import json
-import re
-import os
-import math
+import contextlib
+import io
 import time
+import collections
 
 import discord
 import aiohttp
 # Oops, my finger slipped
 import lxml.html
 # import rethinkdb as r
-import dateutil.parser
-import datetime
 import lxml.etree
 import lxml.html
 import urllib.parse
 from discord.ext import commands
 
-from .common import Cog
+from .common import Cog, fetch_member
+from .extract import BadPage, Extractor
+from .fetch import BodyTooLarge, NotModified, ValidatorStore
+from .leases import LeaseManager
+from .scheduler import FeedSchedule, Scheduler, UpdateWindow
+from .sinks import SinkPipeline
+from .state import TableCache
+from .memdiag import MemoryDiagnostics
+from .outbox import Outbox, delivery_key
+from .profiling import Profile
+from .subindex import SubscriptionIndex
 
 page_num_regex = r"((?:-|\d){3,5})"  # Used to match page #s in RSS feed titles
 # Some newer comics just seem to work better this way
 comic_link_regex = r"\/(?:dnw)?comic\/([a-z0-9_\-]+)(?:\/)?$"
 comic_link_num_regex = r"comic=((?:-|\d){3,5})$"
-parser = lxml.etree.XMLParser(encoding="utf-8")
-html_parser = lxml.html.HTMLParser(encoding="utf-8")
-
-
-class BadPage(Exception):
-  pass
-
-async def http_req(url, headers={}, body=None):
-  async with aiohttp.ClientSession() as session:
-    chosen_req = session.post if body else session.get
-    async with chosen_req(url, headers=headers, data=body) as resp:
-      return {
-        "text": await resp.read(),
-        "resp": resp
-      }
-
-
-async def status_page(comic, bot):
-  base_url = comic["statuspage_slug"] + ".statuspage.io" \
-          if comic.get("statuspage_slug", None) != None \
-          else comic["statuspage_url"]
-  resp = await http_req("https://" + base_url + "/history.json")
-  text = resp["text"]
-
-  if resp["resp"].status == 200:
-    parsed = json.loads(text)
-
-    months = parsed.get("months", None)
-    if months == None:
-      raise BadPage(f"No months prop")
-    month = months[0]
-    if month == None:
-      raise BadPage(f"No months listed")
-    incidents = month.get("incidents", None)
-    if incidents == None:
-      raise BadPage(f"No incidents prop")
-    if len(incidents) < 1:
-      raise BadPage(f"No incidents listed")
-    incident = incidents[0]
-    if incident == None:
-      raise BadPage(f"No incidents listed")
-
-    return {
-      "latest_post": {
-        "unique_id": incident["code"],
-        "url": f"https://{base_url}/incidents/{incident['code']}",
-        "title": incident["name"],
-        "time": bot.r.now(),
-      }
-    }
-  else:
-    raise BadPage("Non-200 status code: " + str(resp["resp"].status))
-
-async def common_rss(comic, bot):
-  resp = await http_req(comic["rss_url"])
-  text = resp["text"]
-
-  if resp["resp"].status == 200:
-    parsed = lxml.etree.fromstring(text, parser=parser)
-    post = parsed.cssselect("rss channel item")[0]
-    title = post.cssselect("title")[0].text
-    url = post.cssselect("link")[0].text
-    page_num_search = re.search(page_num_regex, title)
-    if not page_num_search:
-      page_num_search = re.search(comic_link_regex, url)
-    if not page_num_search:
-      page_num_search = re.search(comic_link_num_regex, url)
-    if not page_num_search:
-      page_num_search = re.search(r"(.*)", url)
-      # raise BadPage(f"No unique ID found for page title: '{title}' or url: '{url}'")
-
-    page_num = page_num_search.group(1)
-    found_pubdate = post.cssselect("pubDate")
-    if found_pubdate:
-        time = dateutil.parser.parse(found_pubdate[0].text).astimezone(bot.r.make_timezone("0:00"))
-    else:
-      time = bot.r.now()
-    return {
-      "latest_post": {
-        "unique_id": page_num,
-        "url": url,
-        "title": title,
-        "time": time
-      }
-    }
 
-async def egs_scrape(comic, bot):
-  resp = await http_req(comic["base_url"])
-  text = resp["text"]
-  xml_document = lxml.html.fromstring(text, parser=html_parser)
-  comic_date_element = xml_document.cssselect('#leftarea div[style*="font-family"]')[0]
-  comic_img_element = xml_document.cssselect('#cc-comic')[0]
-  comic_date = lxml.html.tostring(comic_date_element)
-  comic_name = comic_img_element.attrib["title"]
-  return {
-    "latest_post": {
-      "unique_id": comic_name,
-      "url": f'{comic["base_url"]}{comic_name}',
-      "title": comic_date,
-      "time": bot.r.now()
-    }
-  }
 
-async def twokinds_scrape(comic, bot):
-  resp = await http_req(comic["base_url"])
-  text = resp["text"]
-  xml_document = lxml.html.fromstring(text, parser=html_parser)
-  # Grab the newest page from the 'latest' button
-  article_obj = xml_document.cssselect("article.comic")[0]
-  permalink_page = article_obj.cssselect("div.below-nav p.permalink a[href^=\"/comic\/\"]")[0]
-  permalink_url = permalink_page.attrib["href"]
-  title = article_obj.cssselect("img[alt=\"Comic Page\"]")[0].attrib["title"]
-  try:
-    page_num = int(os.path.basename(os.path.split(permalink_url)[0]))
-  except ValueError as err:
-    raise BadPage(f"No unique ID found for page URL: '{permalink_url}'")
-  
-  return {
-    "latest_post": {
-      "unique_id": page_num,
-      "url": f'{comic["base_url"]}{permalink_url}',
-      "title": title,
-      "time": bot.r.now()
-    }
+def comic_host(comic):
+  """Works out which host a comic is fetched from, so we can limit requests per host"""
+  if comic.get("host"):
+    return comic["host"]
+  # All the *.statuspage.io pages are really the same servers
+  if comic.get("statuspage_slug") is not None:
+    return "statuspage.io"
+  url = comic.get("rss_url") or comic.get("base_url") or comic.get("statuspage_url")
+  if "://" not in url:
+    return url
+  return urllib.parse.urlsplit(url).hostname
+
+async def http_req(bot, url, headers={}, body=None, cache_key=None):
+  # Everything goes through the bot's pooled client so connections and DNS
+  # lookups get reused between polls. Passing a cache_key makes the request
+  # conditional, raising NotModified when nothing changed
+  return await bot.fetcher.request(url, headers, body, cache_key)
+
+
+# Scrapers are declarative specs (see ext/extract.py), compiled once here
+status_page = Extractor({
+  "format": "json",
+  "url": ["https://{statuspage_slug}.statuspage.io/history.json",
+          "https://{statuspage_url}/history.json"],
+  "fields": {
+    "id": {"path": "months.0.incidents.0.code"},
+    "url": {"template": ["https://{statuspage_slug}.statuspage.io/incidents/{id}",
+                         "https://{statuspage_url}/incidents/{id}"]},
+    "title": {"path": "months.0.incidents.0.name"},
+    "time": {"now": True}
   }
+})
+
+common_rss = Extractor({
+  "format": "rss",
+  "url": "{rss_url}",
+  "fields": {
+    "title": {"item": "title"},
+    "url": {"item": "link"},
+    "id": {"first": [
+      {"field": "title", "regex": page_num_regex},
+      {"field": "url", "regex": comic_link_regex},
+      {"field": "url", "regex": comic_link_num_regex},
+      {"field": "url"}
+    ]},
+    "time": {"first": [
+      {"item": "pubDate", "type": "date"},
+      {"now": True}
+    ]}
+  }
+})
+
+egs_scrape = Extractor({
+  "format": "html",
+  "url": "{base_url}",
+  "fields": {
+    "id": {"css": "#cc-comic", "attr": "title"},
+    "url": {"template": "{base_url}{id}"},
+    "title": {"css": '#leftarea div[style*="font-family"]'},
+    "time": {"now": True}
+  }
+})
+
+twokinds_scrape = Extractor({
+  "format": "html",
+  "url": "{base_url}",
+  "fields": {
+    # Grab the newest page from the 'latest' button
+    "permalink": {"css": 'article.comic div.below-nav p.permalink a[href^="/comic/"]', "attr": "href"},
+    "id": {"field": "permalink", "regex": r"/comic/(\d+)", "type": "int"},
+    "url": {"template": "{base_url}{permalink}"},
+    "title": {"css": 'article.comic img[alt="Comic Page"]', "attr": "title"},
+    "time": {"now": True}
+  }
+})
 
 # Ava's Demon scraper because the she doesn't update RSS as soon...
-async def avasdemon_scrape(comic, bot):
-  resp = await http_req(f'{comic["base_url"]}/js/comicQuickLinks.js?v=' + str(math.floor(time.time())))
-
-  blob = re.search(r'var ad_cql="(.*)";$', resp["text"].decode()).group(1)
-  comic_data = ''.join([chr(int(chars, 16)) for chars in re.findall(r".{1,2}", blob)])
-  page_num = re.search(r"var latestComicLinkHtml=(\d+);", comic_data).group(1)
-
-  return {
-    "latest_post": {
-      "unique_id": page_num,
-      "url": f'{comic["base_url"]}/pages.php#{page_num}',
-      "title": f"Page {page_num}",
-      "time": bot.r.now()
-    }
+avasdemon_scrape = Extractor({
+  "format": "text",
+  "url": "{base_url}/js/comicQuickLinks.js?v={timestamp}",
+  "fields": {
+    "comic_data": {"body": True, "regex": r'var ad_cql="(.*)";$', "decode": "hex"},
+    "id": {"field": "comic_data", "regex": r"var latestComicLinkHtml=(\d+);"},
+    "url": {"template": "{base_url}/pages.php#{id}"},
+    "title": {"template": "Page {id}"},
+    "time": {"now": True}
   }
-
-
-async def xkcd_fetch(comic, bot):
-  resp = await http_req(f'{comic["base_url"]}/info.0.json')
-  text = resp["text"]
-  page = json.loads(text)
-  return {
-    "latest_post": {
-      "unique_id": page["num"],
-      "url": f'{comic["base_url"]}/{page["num"]}',
-      "title": f'{page["title"]} ({page["alt"]})',
-      "time": bot.r.time(int(page["year"]), int(page["month"]), int(page["day"]), "Z")
-    }
+})
+
+xkcd_fetch = Extractor({
+  "format": "json",
+  "url": "{base_url}/info.0.json",
+  "fields": {
+    "id": {"path": "num"},
+    "url": {"template": "{base_url}/{id}"},
+    "page_title": {"path": "title"},
+    "alt": {"path": "alt"},
+    "title": {"template": "{page_title} ({alt})"},
+    "year": {"path": "year"},
+    "month": {"path": "month"},
+    "day": {"path": "day"},
+    "time": {"template": "{year}-{month}-{day}", "type": "date"}
   }
+})
 
 
 async def twitter_listener(user, bot):
@@ -195,30 +152,35 @@ webcomics = [
     "slug": "discordstatus",
     "friendly": "Discord Status",
     "check_updates": status_page,
+    "max_interval": 10 * 60,  # Incidents don't follow a schedule
     "statuspage_slug": "discord"
   },
   {
     "slug": "cloudflarestatus",
     "friendly": "Cloutflare Status",
     "check_updates": status_page,
+    "max_interval": 10 * 60,  # Incidents don't follow a schedule
     "statuspage_slug": "cloudflare"
   },
   {
     "slug": "githubstatus",
     "friendly": "Github Status",
     "check_updates": status_page,
+    "max_interval": 10 * 60,  # Incidents don't follow a schedule
     "statuspage_url": "www.githubstatus.com"
   },
   {
     "slug": "redditstatus",
     "friendly": "Reddit Status",
     "check_updates": status_page,
+    "max_interval": 10 * 60,  # Incidents don't follow a schedule
     "statuspage_slug": "reddit"
   },
   {
     "slug": "dostatus",
     "friendly": "Digital Ocean Status",
     "check_updates": status_page,
+    "max_interval": 10 * 60,  # Incidents don't follow a schedule
     "statuspage_url": "status.digitalocean.com"
   },
   {
@@ -333,6 +295,7 @@ webcomics = [
     "base_url": "https://xkcd.com",
     "friendly": "XKCD",
     "check_updates": xkcd_fetch,
+    "update_windows": [{"weekdays": [0, 2, 4], "start_hour": 3, "end_hour": 7}],
     "slug": "xkcd"
   },
   {
@@ -361,6 +324,10 @@ webcomics = [
   # }
 ]
 
+# A comic can also bring its own spec rather than sharing one of the above
+webcomics = [{**comic, "check_updates": Extractor(comic["extract"])} if "extract" in comic else comic
+             for comic in webcomics]
+
 
 class Modular(Cog):
   """Updates users when new webcomics are released!"""
@@ -368,6 +335,7 @@ class Modular(Cog):
   def __init__(self, bot):
     super().__init__(bot)
     self.ready = False
+    self.profiling = False
     if self.bot.is_ready():
       self.check_updates()
     # We cache this because we're intellectuals who want efficiency
@@ -375,120 +343,302 @@ class Modular(Cog):
     self.comic_dict = {}
     for comic in webcomics:
       self.comic_dict[comic["slug"]] = comic
+    # Feeds are fetched concurrently, but we don't want to open hundreds of
+    # connections at once or hammer one host with several feeds in parallel
+    self.fetch_semaphore = asyncio.Semaphore(getattr(self.bot.config, "fetch_concurrency", 16))
+    per_host = getattr(self.bot.config, "fetch_per_host", 1)
+    self.host_semaphores = collections.defaultdict(lambda: asyncio.Semaphore(per_host))
+    # ETag/Last-Modified/body hash per feed, so unchanged feeds cost next to nothing
+    self.validator_cache = TableCache(self.bot, "validators")
+    # Latest post for every comic. Change detection and latest never need
+    # the database, and each cycle's changes go out in one upsert
+    self.updates = TableCache(self.bot, "updates")
+    # Who to announce each comic to, without asking the database every time
+    self.sub_index = SubscriptionIndex(self.bot)
+    # Announcements are queued in the database and delivered in the background
+    self.outbox = Outbox(self.bot, self.sub_index.resolve, **getattr(self.bot.config, "outbox", {}))
+    # Polling and delivering can be separate processes, see poller.py
+    if self.bot.delivers:
+      self.outbox.start()
+    # Mastodon and friends, each with its own queue so they can't hold up Discord
+    self.sinks = SinkPipeline.from_config(self.bot, self.bot.config)
+    if self.bot.polls:
+      self.sinks.start()
+
+    # Each feed gets polled on its own schedule instead of all at once
+    self.scheduler = Scheduler()
+    # With several pollers, each only polls the feeds it holds leases on
+    leases = getattr(self.bot.config, "leases", None)
+    self.leases = LeaseManager(self.bot, self.comic_slugs, self.feeds_acquired, self.feeds_released,
+                               **leases) if leases and self.bot.polls else None
+    # tracemalloc diffs between cycles, when asked for or every so often
+    self.memory_diagnostics = MemoryDiagnostics(self.bot, **getattr(self.bot.config, "memdiag", {}))
+    # Set to check whatever's due without waiting out the sleep. Commands that
+    # need a check wait on the scheduler's next one rather than running their
+    # own alongside it, see wait_for_check
+    self.check_wakeup = asyncio.Event()
+    self.next_check = None
 
     async def run_check():
       await self.bot.db_connect_task
+      self.sub_index.start()
+      if not self.bot.polls:
+        return
+      await self.validator_cache.load()
+      self.bot.fetcher.validators = ValidatorStore(self.validator_cache)
+      await self.updates.load()
+      if self.leases:
+        # Feeds get scheduled as we're given them
+        self.leases.start()
+      else:
+        self.load_schedules()
       while True:
-        self.bot.logger.info("Checking RSS automatically...")
+        self.check_wakeup.clear()
+        due = self.scheduler.pop_due(time.time())
+        if due:
+          self.bot.logger.info(f"Checking {len(due)} feeds automatically...")
+          waiting, self.next_check = self.next_check, None
+          profile = Profile(self.bot.loop) if waiting and waiting["profile"] else None
+          try:
+            with profile or contextlib.nullcontext():
+              await self.check_updates([self.comic_dict[slug] for slug in due])
+          except Exception as err:
+            self.bot.logger.exception("penid")
+            self.bot.logger.exception(err)
+          if waiting and not waiting["done"].done():
+            waiting["done"].set_result(profile)
         try:
-          await self.check_updates()
-        except Exception as err:
-          self.bot.logger.exception("penid")
-          self.bot.logger.exception(err)
-        await asyncio.sleep(10 * 60)  # Check RSS every 10 min
+          await asyncio.wait_for(self.check_wakeup.wait(), timeout=self.scheduler.sleep_time(time.time()))
+        except asyncio.TimeoutError:
+          pass
     self.check_loop = self.bot.loop.create_task(run_check())
 
   def cog_unload(self):
     self.check_loop.cancel()
-
-  async def check_updates(self):
+    if self.leases:
+      self.leases.stop()
+    self.sub_index.stop()
+    self.outbox.stop()
+    self.sinks.stop()
+    self.bot.fetcher.validators = None
+
+  # Anything that could change which channels/roles subscriptions point at
+  @commands.Cog.listener()
+  async def on_ready(self):
+    self.sub_index.invalidate()
+
+  @commands.Cog.listener()
+  async def on_guild_channel_delete(self, channel):
+    self.sub_index.invalidate()
+
+  @commands.Cog.listener()
+  async def on_guild_role_delete(self, role):
+    self.sub_index.invalidate()
+
+  @commands.Cog.listener()
+  async def on_guild_available(self, guild):
+    self.sub_index.invalidate()
+
+  @commands.Cog.listener()
+  async def on_guild_remove(self, guild):
+    self.sub_index.invalidate()
+
+  def load_schedules(self):
     for comic in webcomics:
-      # haha yes we have the comics now we do their update hook!
-      friendly_name = comic["friendly"]
-      self.bot.logger.info(f"Fetching {friendly_name}")
-      try:
-        results = await comic["check_updates"](comic, self.bot)
-      except lxml.etree.XMLSyntaxError as err:
-        self.bot.logger.error(f"Error occurred while fetching {friendly_name}: {err}")
-      except aiohttp.client_exceptions.ClientConnectionError as err:
-        self.bot.logger.error(f"Error occurred while fetching {friendly_name}: {err}")
-        continue
-      except BadPage as err:
-        self.bot.logger.error(f"Error occurred while fetching {friendly_name}: {err}")
-        continue
-      except Exception as err:
-        self.bot.logger.error(f"VERY bad, this should never happen! {friendly_name}: {err}")
-        self.bot.logger.exception(err)
-        continue
-
-      self.bot.logger.info(f"Checked for updates on {friendly_name}")
-      announced_post = await self.bot.r.table("updates").get(comic["slug"]).run(self.bot.r_connection)
-
-      if announced_post and results["latest_post"]["unique_id"] == announced_post["unique_id"]:
-        self.bot.logger.info(f"No updates for {friendly_name}")
-        continue
-      self.bot.logger.info(f'Found update for {friendly_name}, unique_id: {results["latest_post"]["unique_id"]}')
-
-      await self.bot.r.table("updates").insert({
-        "id": comic["slug"],
-        "unique_id": results["latest_post"]["unique_id"],
-        "url": results["latest_post"]["url"],
-        "title": results["latest_post"]["title"],
-        "time": results["latest_post"]["time"]
-      }, conflict="update").run(self.bot.r_connection)
-      await self.announce_comic(comic, results)
-
-  async def announce_comic(self, comic, results):
-    channels = await self.get_channels(comic["slug"])
+      self.schedule_comic(comic)
+
+  def schedule_comic(self, comic):
+    config = self.bot.config
+    update = self.updates.get(comic["slug"]) or {}
+    self.scheduler.add(FeedSchedule(
+      comic["slug"],
+      history=update.get("history", []),
+      windows=[UpdateWindow.from_dict(window) for window in comic.get("update_windows", [])],
+      min_interval=comic.get("min_interval", getattr(config, "poll_min_interval", 5 * 60)),
+      interval=comic.get("interval", getattr(config, "poll_interval", 10 * 60)),
+      max_interval=comic.get("max_interval", getattr(config, "poll_max_interval", 2 * 60 * 60))))
+
+  async def feeds_acquired(self, slugs):
+    # Whoever had these before us may have moved them on since we loaded
+    await self.updates.reload(slugs)
+    await self.validator_cache.reload(slugs)
+    for slug in slugs:
+      self.schedule_comic(self.comic_dict[slug])
+
+  def feeds_released(self, slugs):
+    for slug in slugs:
+      self.scheduler.remove(slug)
+
+  def wait_for_check(self, profile=False):
+    """A future for the next scheduled check finishing, with its Profile if asked for"""
+    if self.next_check is None:
+      self.next_check = {"done": self.bot.loop.create_future(), "profile": False}
+    self.next_check["profile"] |= profile
+    return self.next_check["done"]
+
+  async def check_updates(self, comics=webcomics):
+    tracer = self.bot.tracer
+    if self.leases:
+      comics = [comic for comic in comics if self.leases.owns(comic["slug"])]
+    with tracer.root("poll cycle", cat="cycle", feeds=len(comics)):
+      started = time.monotonic()
+      results = await asyncio.gather(*[self.check_comic(comic) for comic in comics],
+                                     return_exceptions=True)
+      now = time.time()
+      updated = []
+      for comic, result in zip(comics, results):
+        if isinstance(result, Exception):
+          self.bot.logger.error(f"Failed to process {comic['friendly']}: {result}")
+          result = None
+        if result:
+          updated.append((comic, result))
+        self.scheduler.record(comic["slug"], now, bool(result))
+
+      # Queue the announcements before saving the new posts. If we die in
+      # between, the posts get detected again and the outbox ignores the repeats.
+      # If queueing fails, nothing gets saved and we'll try again next time
+      if self.leases:
+        # Anything handed over mid-cycle is the new owner's to announce
+        updated = [(comic, result) for comic, result in updated if self.leases.owns(comic["slug"])]
+      if updated:
+        try:
+          with tracer.span("enqueue announcements", cat="announce", updated=len(updated)):
+            await self.enqueue_announcements(updated)
+        except Exception as err:
+          self.bot.logger.error(f"Failed to queue announcements: {err}")
+          self.bot.logger.exception(err)
+          updated = []
+      for comic, result in updated:
+        self.save_update(comic, result)
+      # Everything new this cycle gets saved in one go
+      with tracer.span("save", cat="db"):
+        await self.updates.flush()
+        await self.validator_cache.flush()
+      elapsed = time.monotonic() - started
+      self.bot.metrics.cycle_seconds.observe(elapsed)
+      self.memory_diagnostics.cycle_finished()
+      self.bot.logger.info(f"Checked {len(comics)} comics in {elapsed:.1f}s")
+      self.bot.logger.info(f"HTTP client: {self.bot.fetcher.format_stats()}")
+      self.bot.logger.info(self.bot.parse_pool.format_stats())
+
+  async def fetch_comic(self, comic):
+    # Grab the host slot first so we don't sit on a global slot while
+    # another feed on the same host is still going. The gap before the fetch
+    # span is time spent waiting for those
+    with self.bot.tracer.span(comic["slug"], cat="feed"):
+      async with self.host_semaphores[comic_host(comic)]:
+        async with self.fetch_semaphore:
+          return await comic["check_updates"](comic, self.bot)
+
+  async def check_comic(self, comic):
+    """Checks a single comic, returning its results if it has a new post"""
+    # haha yes we have the comics now we do their update hook!
     friendly_name = comic["friendly"]
+    self.bot.logger.info(f"Fetching {friendly_name}")
+    try:
+      results = await self.fetch_comic(comic)
+    except NotModified:
+      self.bot.logger.info(f"No updates for {friendly_name} (not modified)")
+      return
+    except lxml.etree.XMLSyntaxError as err:
+      self.bot.logger.error(f"Error occurred while fetching {friendly_name}: {err}")
+      return
+    except aiohttp.client_exceptions.ClientConnectionError as err:
+      self.bot.logger.error(f"Error occurred while fetching {friendly_name}: {err}")
+      return
+    except BadPage as err:
+      self.bot.logger.error(f"Error occurred while fetching {friendly_name}: {err}")
+      return
+    except BodyTooLarge as err:
+      self.bot.logger.error(f"Error occurred while fetching {friendly_name}: {err}")
+      return
+    except Exception as err:
+      self.bot.logger.error(f"VERY bad, this should never happen! {friendly_name}: {err}")
+      self.bot.logger.exception(err)
+      return
+
+    self.bot.logger.info(f"Checked for updates on {friendly_name}")
+    announced_post = self.updates.get(comic["slug"])
+
+    if announced_post and results["latest_post"]["unique_id"] == announced_post["unique_id"]:
+      self.bot.logger.info(f"No updates for {friendly_name}")
+      self.commit_validators(comic)
+      return
+    self.bot.logger.info(f'Found update for {friendly_name}, unique_id: {results["latest_post"]["unique_id"]}')
+    return results
+
+  def save_update(self, comic, results):
+    self.updates.put({
+      **(self.updates.get(comic["slug"]) or {}),
+      "id": comic["slug"],
+      "unique_id": results["latest_post"]["unique_id"],
+      "url": results["latest_post"]["url"],
+      "title": results["latest_post"]["title"],
+      "time": results["latest_post"]["time"],
+      # Kept around so the scheduler can learn when this comic updates
+      "history": self.scheduler.history(comic["slug"])
+    })
+    self.commit_validators(comic)
+
+  def commit_validators(self, comic):
+    # Only once the body has been dealt with, otherwise a failure would
+    # leave the feed looking unchanged forever
+    if self.bot.fetcher.validators:
+      self.bot.fetcher.validators.commit(comic["slug"])
+
+  async def enqueue_announcements(self, updated):
+    """Queues an outbox row for every channel subscribed to each (comic, results)"""
+    rows = []
+    for comic, results in updated:
+      latest_post = results["latest_post"]
+      for subscription in await self.get_subscriptions(comic["slug"]):
+        rows.append({
+          "id": delivery_key(comic["slug"], latest_post["unique_id"], subscription["channel_id"]),
+          "slug": comic["slug"],
+          "channel_id": subscription["channel_id"],
+          "guild_id": subscription["guild_id"],
+          "role_id": subscription["role_id"],
+          "content": self.format_update(comic, results),
+          # Only when the feed told us, rather than it being when we noticed
+          "published": latest_post["published"].timestamp()
+            if latest_post.get("published") else None
+        })
+    queued = await self.outbox.enqueue(rows)
+    self.bot.logger.info(f"Queued {queued} new announcements for {len(updated)} comics")
+
+    if self.bot.prod:
+      for comic, results in updated:
+        self.sinks.publish({
+          "slug": comic["slug"],
+          "friendly": comic["friendly"],
+          "title": results["latest_post"]["title"],
+          "url": results["latest_post"]["url"],
+          "content": self.format_update(comic, results)
+        })
+
+  def format_update(self, comic, results):
     post_title = results["latest_post"]["title"]
     url = results["latest_post"]["url"]
-    response = f"New panels for {friendly_name}!\nLatest panel:\n{post_title}\n{url}"
-
-    if self.bot.prod and self.bot.config.mastodon and self.bot.config.mastodon["token"] and self.bot.config.mastodon["instance_url"]:
-      await http_req(f"{self.bot.config.mastodon['instance_url']}/api/v1/statuses",
-                     {"Authorization":
-                      f"Bearer {self.bot.config.mastodon['token']}"},
-                     {
-                       "status": f"{response}\n\n #avabot_update #avabot_update_{comic['slug']}",
-                       "visibility": "unlisted"
-                     })
-      
-    for channel in channels:
-      if channel["role"]:
-        new_page_role = channel["role"]
-        try:
-          if self.bot.prod:
-            await new_page_role.edit(
-              mentionable=True,
-              reason=f"New panels for {friendly_name} ({post_title})")
-          else:  # Safety precaution
-            await new_page_role.edit(
-              mentionable=False,
-              reason="Local bot, new page without ping")
-        except discord.Forbidden:
-          pass
+    return f"New panels for {comic['friendly']}!\nLatest panel:\n{post_title}\n{url}"
 
-        try:
-          await channel["channel"].send(channel["role"].mention + ": " + response)
-        except discord.Forbidden:
-          pass
-
-        try:
-          await new_page_role.edit(
-            mentionable=False,
-            reason=f"New panels for {friendly_name} ({post_title})")
-        except discord.Forbidden:
-          pass
-      else:
-        await channel["channel"].send(response)
-
-  async def get_channels(self, comic_slug):
+  async def get_subscriptions(self, comic_slug):
+    if self.sub_index.ready.is_set():
+      return self.sub_index.for_slug(comic_slug)
+    # Only until the changefeed has caught up
     subscriptions = await self.bot.r.table("subscriptions").get_all(comic_slug, index="slug").run(self.bot.r_connection)
-    return [{
-      "channel": self.bot.get_channel(int(subscription["channel_id"])),
-      "role": (discord.utils.get(
-        self.bot.get_channel(int(subscription["channel_id"])).guild.roles,
-        id=int(subscription["role_id"])) if subscription["role_id"] else None) or None
-    } async for subscription in subscriptions
-      if self.bot.get_channel(int(subscription["channel_id"]))]
+    return [subscription async for subscription in subscriptions]
 
   @commands.command()
   async def latest(self, ctx, *, comic_slug: str):
     """Gets latest panel of a webcomic"""
     if not comic_slug in self.comic_dict:
       return await ctx.send("Comic doesn't exist")
-    update = await self.bot.r.table("updates").get(comic_slug).run(self.bot.r_connection)
+    if self.updates.loaded:
+      update = self.updates.get(comic_slug)
+    else:
+      update = await self.bot.r.table("updates").get(comic_slug).run(self.bot.r_connection)
+    if not update:
+      return await ctx.send(f"No panels for {comic_slug} yet")
     await ctx.send(f"Latest panel for {comic_slug}: {update['title']} - {update['url']}")
 
   @commands.command(aliases=["unsubscribe", "unsub", "sub"])
@@ -524,11 +674,12 @@ class Modular(Cog):
     if not allowed:
       return await ctx.send("Role not found")
 
-    if role in ctx.author.roles:
-      await ctx.author.remove_roles(role)
+    member = await fetch_member(ctx.guild, ctx.author)
+    if role in member.roles:
+      await member.remove_roles(role)
       return await ctx.send("Unsubscribed!")
     else:
-      await ctx.author.add_roles(role)
+      await member.add_roles(role)
       return await ctx.send("Subscribed!")
 
   @commands.group(invoke_without_command=True)
@@ -579,7 +730,9 @@ class Modular(Cog):
       "guild_id": str(ctx.guild.id),
       "slug": slug
     }
-    results = await self.bot.r.table("subscriptions").filter(sub_dict).delete().run(self.bot.r_connection)
+    results = await self.bot.r.table("subscriptions").filter(sub_dict).delete(return_changes=True).run(self.bot.r_connection)
+    # The changefeed will tell us too, but don't wait for it
+    self.sub_index.apply_changes(results)
     if results["deleted"] <= 0:
       return await ctx.send("No subscriptions deleted")
     elif results["deleted"] > 0:
@@ -601,10 +754,12 @@ class Modular(Cog):
       "guild_id": str(ctx.guild.id),
       "slug": slug,
     }
-    await self.bot.r.table("subscriptions").filter(sub_dict).delete().run(self.bot.r_connection)
+    results = await self.bot.r.table("subscriptions").filter(sub_dict).delete(return_changes=True).run(self.bot.r_connection)
+    self.sub_index.apply_changes(results)
     sub_dict["role_id"] = str(role.id) if role else None
 
-    await self.bot.r.table("subscriptions").insert(sub_dict).run(self.bot.r_connection)
+    results = await self.bot.r.table("subscriptions").insert(sub_dict, return_changes=True).run(self.bot.r_connection)
+    self.sub_index.apply_changes(results)
     return await ctx.send(f'Done! {channel.mention} has a new subscription to {self.comic_dict[slug]["friendly"]}!')
 
   @commands.command()
@@ -618,9 +773,93 @@ class Modular(Cog):
   @commands.is_owner()
   async def recheck_all(self, ctx):
     """Checks for updates to webcomics"""
-    await self.check_updates()
+    if not self.bot.polls:
+      return await ctx.send("Feeds are polled by poller.py, not this process")
+    if not self.scheduler.schedules:
+      return await ctx.send("No feeds to check here yet")
+    # Through the scheduler, so it can't overlap a scheduled check and each
+    # feed's history only gets this one poll
+    self.scheduler.due_now(time.time())
+    checked = self.wait_for_check()
+    self.check_wakeup.set()
+    await checked
     await ctx.send("triple gay")
 
+  @commands.command()
+  @commands.is_owner()
+  async def profile(self, ctx, seconds: float=None):
+    """Profiles the next update check, or everything for some seconds"""
+    if self.profiling:
+      return await ctx.send("Already profiling")
+    if seconds is None and not self.bot.polls:
+      return await ctx.send("Feeds are polled by poller.py, not this process")
+    self.profiling = True
+    try:
+      if seconds is None:
+        # The scheduler's own check, an extra one would fetch and save the
+        # same feeds twice at once
+        await ctx.send("Profiling the next scheduled check for updates...")
+        profile = await self.wait_for_check(profile=True)
+      else:
+        await ctx.send(f"Profiling for {seconds}s...")
+        with Profile(self.bot.loop) as profile:
+          await asyncio.sleep(seconds)
+    finally:
+      self.profiling = False
+    name = "cycle" if seconds is None else f"{seconds:g}s"
+    await ctx.send(
+      f"Profiled {profile.elapsed:.1f}s, {profile.sampler.samples} stack samples. "
+      f"The .collapsed file goes into flamegraph.pl or speedscope",
+      files=[discord.File(io.BytesIO(data), filename=filename)
+             for filename, data in profile.files(f"profile-{name}")])
+
+  @commands.command()
+  @commands.is_owner()
+  async def memdiag(self, ctx, cycles: int=3):
+    """Diffs memory across a few update checks to find what keeps growing"""
+    if not self.bot.polls:
+      return await ctx.send("Feeds are polled by poller.py, not this process")
+    diagnostics = self.memory_diagnostics
+    if diagnostics.session:
+      await ctx.send("Already tracing, waiting for that to finish...")
+      session = diagnostics.session
+    else:
+      # The scheduler's own checks, running extra ones would fetch and save
+      # the same feeds twice at once
+      await ctx.send(f"Tracing allocations over the next {cycles} scheduled checks for updates...")
+      session = diagnostics.begin(cycles)
+    await session["done"].wait()
+    report = diagnostics.last_report
+    if len(report) < 1900:
+      return await ctx.send(f"```\n{report}\n```")
+    await ctx.send(file=discord.File(io.BytesIO(report.encode()), filename="memdiag.txt"))
+
+  @commands.command()
+  @commands.is_owner()
+  async def httpstats(self, ctx):
+    """Shows connection reuse stats for the shared HTTP client"""
+    await ctx.send(self.bot.fetcher.format_stats())
+
+  @commands.command()
+  @commands.is_owner()
+  async def sinkstats(self, ctx):
+    """Shows how the external sinks are keeping up"""
+    await ctx.send(self.sinks.format_stats())
+
+  @commands.command()
+  @commands.is_owner()
+  async def parsestats(self, ctx):
+    """Shows how much parsing has been kept off the event loop"""
+    await ctx.send(self.bot.parse_pool.format_stats())
+
+  @commands.command()
+  @commands.is_owner()
+  async def leasestats(self, ctx):
+    """Shows how feeds are split between pollers"""
+    if not self.leases:
+      return await ctx.send("This process polls every feed")
+    await ctx.send(self.leases.format_stats())
+
 
 def setup(bot):
   bot.add_cog(Modular(bot))
@@ -0,0 +1,292 @@
+import asyncio
+import datetime
+import hashlib
+import os
+import socket
+import time
+import uuid
+
+import discord
+
+from .state import ensure_table
+
+
+class ChannelNotFound(Exception):
+  """A row's channel is gone, or we can no longer see it"""
+  pass
+
+
+def delivery_key(slug, unique_id, channel_id):
+  """Idempotency key for announcing one post in one channel"""
+  return hashlib.sha1(f"{slug}\0{unique_id}\0{channel_id}".encode()).hexdigest()
+
+
+def shard_key(guild_id):
+  """The part of a guild ID that picks its shard, (guild_id >> 22) % shard_count
+
+  Whole guild IDs don't fit in the database's doubles, this does.
+  """
+  return int(guild_id) >> 22
+
+
+class Outbox:
+  """Durable queue of announcements, one row per (post, channel) in the outbox table
+
+  Rows are keyed on delivery_key, so detecting the same post twice (say after
+  a crash before the updates table was written) can't queue it twice. A
+  background drainer claims pending rows, sends them through the dispatcher
+  and retries failures with exponential backoff. When sharded, each process
+  only delivers rows for guilds on its own shards. Claims are compare and
+  set, so with several drainers a row still goes to exactly one of them.
+  Rows still claimed claim_timeout seconds later belong to a process that
+  died, and are checked against the channel's recent messages before being
+  sent again, so restarts don't double post.
+  """
+
+  def __init__(self, bot, resolve, batch_size=200, max_attempts=8, retry_delay=30,
+               poll_interval=60, keep_for=7 * 24 * 60 * 60, claim_timeout=5 * 60):
+    self.bot = bot
+    self.name = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+    self.resolve = resolve  # (channel_id, role_id) -> (channel, role)
+    self.batch_size = batch_size
+    self.max_attempts = max_attempts
+    self.retry_delay = retry_delay
+    self.poll_interval = poll_interval
+    self.keep_for = keep_for
+    self.claim_timeout = claim_timeout
+    self.wakeup = asyncio.Event()
+    self.task = None
+    self.follower = None
+
+  def start(self):
+    self.task = self.bot.loop.create_task(self.run())
+
+  def stop(self):
+    if self.task:
+      self.task.cancel()
+    if self.follower:
+      self.follower.cancel()
+
+  def wake(self):
+    self.wakeup.set()
+
+  async def setup(self):
+    await ensure_table(self.bot, "outbox", indexes=["status"])
+
+  async def enqueue(self, rows):
+    """Queues rows (with id, channel_id, guild_id, role_id and content), returns how many were new
+
+    Rows can also have "published", the post's publish time as a timestamp
+    if we know it, so we can tell how long announcing took from there.
+    """
+    if not rows:
+      return 0
+    now = time.time()
+    for row in rows:
+      row.update({
+        "shard_key": shard_key(row["guild_id"]),
+        "status": "pending",
+        "attempts": 0,
+        "next_attempt": now,
+        "created": now
+      })
+    # Rows we've queued before are conflicts and get left alone
+    result = await self.bot.r.table("outbox").insert(rows, conflict="error").run(self.bot.r_connection)
+    self.wake()
+    return result["inserted"]
+
+  async def run(self):
+    await self.bot.db_connect_task
+    await self.setup()
+    self.follower = self.bot.loop.create_task(self.follow())
+    await self.bot.wait_until_ready()
+    last_cleanup = 0
+    last_recovery = 0
+    while True:
+      self.wakeup.clear()
+      more = False
+      try:
+        if time.time() - last_recovery > self.claim_timeout / 2:
+          await self.recover()
+          last_recovery = time.time()
+        more = await self.drain()
+        if time.time() - last_cleanup > 60 * 60:
+          await self.cleanup()
+          last_cleanup = time.time()
+      except asyncio.CancelledError:
+        raise
+      except Exception as err:
+        self.bot.logger.error(f"Failed to drain the outbox: {err}")
+        self.bot.logger.exception(err)
+      if not more:
+        try:
+          await asyncio.wait_for(self.wakeup.wait(), timeout=self.poll_interval)
+        except asyncio.TimeoutError:
+          pass
+
+  def ours(self, row):
+    """Whether a row's guild is on one of our shards, as ReQL"""
+    shard_ids = getattr(self.bot, "shard_ids", None)
+    if not shard_ids:
+      # Not sharded, or every shard is in this process
+      return True
+    # Rows queued before shard_key existed go to shard 0
+    return self.bot.r.expr(shard_ids).contains(
+      row["shard_key"].default(0).mod(self.bot.shard_count))
+
+  async def follow(self):
+    """Wakes the drainer whenever a row is queued, including by a separate poller"""
+    r = self.bot.r
+    while True:
+      try:
+        inserts = await r.table("outbox").changes() \
+          .filter(lambda change: change["old_val"].eq(None).and_(self.ours(change["new_val"]))) \
+          .run(self.bot.r_connection)
+        async for change in inserts:
+          self.wake()
+      except asyncio.CancelledError:
+        raise
+      except Exception as err:
+        self.bot.logger.error(f"Outbox changefeed died, restarting: {err}")
+        await asyncio.sleep(5)
+
+  async def claim(self, ids, condition, **fields):
+    """Takes the rows condition (ReQL, of the row) still holds for, returning their IDs"""
+    r = self.bot.r
+    result = await r.table("outbox").get_all(*ids).update(
+      lambda row: r.branch(condition(row), {**fields, "status": "sending", "claimer": self.name}, {}),
+      return_changes=True).run(self.bot.r_connection)
+    # Rows someone else got to first are left unchanged, so aren't in here
+    return {change["new_val"]["id"] for change in result["changes"]}
+
+  def finish(self, update):
+    """Writes an outcome, unless the row's been taken off us in the meantime"""
+    r = self.bot.r
+    return r.table("outbox").get(update["id"]).update(
+      lambda row: r.branch(row["claimer"].default(None).eq(self.name), update, {}))
+
+  async def recover(self):
+    """Sorts out rows claimed by a process that never finished them"""
+    r = self.bot.r
+    now = time.time()
+    stale = now - self.claim_timeout
+    rows = await r.table("outbox").get_all("sending", index="status") \
+      .filter(lambda row: (row["claimed"] < stale).and_(self.ours(row))) \
+      .coerce_to("array").run(self.bot.r_connection)
+    if not rows:
+      return
+    # Only one drainer gets to recover each row, and only if nobody's claimed
+    # it since we looked. The claim time stays, it's what already_sent looks
+    # back from
+    claimers = r.expr({row["id"]: row.get("claimer") for row in rows})
+    claimed = await self.claim(
+      [row["id"] for row in rows],
+      lambda row: row["status"].eq("sending").and_(row["claimed"].lt(stale))
+      .and_(row["claimer"].default(None).eq(claimers[row["id"]])),
+      recovered=now)
+    rows = [row for row in rows if row["id"] in claimed]
+    for row in rows:
+      delivered = await self.already_sent(row)
+      await self.finish(
+        {"id": row["id"], "status": "sent", "sent": time.time()} if delivered
+        else {"id": row["id"], "status": "pending"}
+      ).run(self.bot.r_connection)
+    if rows:
+      self.bot.logger.info(f"Recovered {len(rows)} interrupted deliveries")
+
+  async def already_sent(self, row):
+    channel, _ = self.resolve(row["channel_id"], row["role_id"])
+    if not channel:
+      return False
+    after = datetime.datetime.utcfromtimestamp(row["claimed"] - 60)
+    try:
+      async for message in channel.history(limit=50, after=after):
+        if message.author == self.bot.user and row["content"] in message.content:
+          return True
+    except discord.HTTPException:
+      pass
+    return False
+
+  async def drain(self):
+    """Sends a batch of due rows, returning True if there might be more"""
+    r = self.bot.r
+    now = time.time()
+    rows = await r.table("outbox").get_all("pending", index="status") \
+      .filter(lambda row: (row["next_attempt"] <= now).and_(self.ours(row))) \
+      .limit(self.batch_size) \
+      .coerce_to("array").run(self.bot.r_connection)
+    if not rows:
+      return False
+    with self.bot.tracer.root("outbox drain", cat="announce", rows=len(rows)):
+      await self.deliver(rows, now)
+    return len(rows) == self.batch_size
+
+  async def deliver(self, rows, now):
+    r = self.bot.r
+    claimed = await self.claim([row["id"] for row in rows],
+                               lambda row: row["status"].eq("pending"), claimed=now)
+    # Whatever another drainer claimed first is theirs to send
+    rows = [row for row in rows if row["id"] in claimed]
+    if not rows:
+      return
+
+    deliveries = []
+    errors = {}
+    for row in rows:
+      row["claimed"] = now
+      channel, role = self.resolve(row["channel_id"], row["role_id"])
+      if not channel:
+        # Only drained once we're ready, so it isn't just not loaded yet
+        errors[row["id"]] = ChannelNotFound(f"Channel {row['channel_id']} not found")
+      else:
+        deliveries.append({
+          "channel": channel,
+          "role": role,
+          "content": row["content"],
+          "row": row
+        })
+    report = await self.bot.dispatcher.announce(deliveries, ping=self.bot.prod)
+
+    sent = {delivery["row"]["id"] for delivery in deliveries if delivery.get("sent")}
+    errors.update({delivery["row"]["id"]: delivery.get("error") for delivery in deliveries})
+    updates = []
+    metrics = self.bot.metrics
+    for row in rows:
+      if row["id"] in sent:
+        updates.append({"id": row["id"], "status": "sent", "sent": time.time()})
+        metrics.detect_to_announce.observe(time.time() - row["created"])
+        if row.get("published"):
+          metrics.publish_to_announce.observe(time.time() - row["published"])
+      else:
+        updates.append(self.failure(row, errors.get(row["id"])))
+    await r.expr(updates).for_each(lambda update: self.finish(update)).run(self.bot.r_connection)
+
+    latencies = report["latencies"]
+    stats = self.bot.dispatcher.stats
+    self.bot.logger.info(
+      f"Delivered {len(sent)}/{len(rows)} queued announcements in {report['elapsed']:.2f}s "
+      f"(median {latencies[len(latencies) // 2] if latencies else 0:.2f}s, "
+      f"{stats['bucket_wait']:.1f}s total rate limit wait, "
+      f"{stats['direct_pings']} direct pings/{stats['role_toggles']} role toggles so far)")
+
+  def failure(self, row, error):
+    attempts = row["attempts"] + 1
+    # No amount of retrying fixes missing permissions or a deleted channel
+    permanent = isinstance(error, (discord.Forbidden, discord.NotFound, ChannelNotFound))
+    if permanent or attempts >= self.max_attempts:
+      self.bot.logger.warning(f"Giving up on delivery {row['id']} to {row['channel_id']}: {error}")
+      return {"id": row["id"], "status": "failed", "attempts": attempts, "error": str(error)}
+    return {
+      "id": row["id"],
+      "status": "pending",
+      "attempts": attempts,
+      "next_attempt": time.time() + min(self.retry_delay * 2 ** (attempts - 1), 6 * 60 * 60),
+      "error": str(error) if error else "Not sent"
+    }
+
+  async def cleanup(self):
+    cutoff = time.time() - self.keep_for
+    r = self.bot.r
+    await r.table("outbox").get_all("sent", "failed", index="status") \
+      .filter(r.row["created"] < cutoff) \
+      .delete().run(self.bot.r_connection)
@@ -0,0 +1,107 @@
+import asyncio
+import concurrent.futures
+import itertools
+import threading
+import time
+
+import lxml.html
+
+from .metrics import Metrics
+
+_local = threading.local()
+
+
+def html_parser():
+  """This worker's own HTML parser, lxml parsers can't be shared between threads"""
+  parser = getattr(_local, "html_parser", None)
+  if parser is None:
+    parser = _local.html_parser = lxml.html.HTMLParser(encoding="utf-8")
+  return parser
+
+
+def timed(func, *args):
+  # Runs in the worker, so the time is what the worker spent, not time queued
+  started = time.perf_counter()
+  result = func(*args)
+  return result, time.perf_counter() - started
+
+
+class Lane:
+  """Runs every job for one stateful parser on the same thread"""
+
+  def __init__(self, pool, executor):
+    self.pool = pool
+    self.executor = executor
+
+  async def run(self, func, *args):
+    return await self.pool._submit(self.executor, func, *args)
+
+
+class ParsePool:
+  """Runs parsing and extraction somewhere other than the event loop
+
+  mode is "thread", "process" or "inline" (on the loop, like before). Whole
+  documents go to the configured executor, so with processes func and its
+  arguments have to pickle. Parsers that keep state between calls, like the
+  streaming RSS parser, can't leave this process, and lxml parsers can't
+  move between threads either. Those get a lane, one of a few single
+  threads, and are fed there for their whole life (inline in inline mode).
+  """
+
+  modes = ("thread", "process", "inline")
+
+  def __init__(self, mode="thread", workers=2, metrics=None):
+    if mode not in self.modes:
+      raise ValueError(f"Unknown parse pool mode: {mode}")
+    self.mode = mode
+    self.metrics = metrics or Metrics()
+    self.executor = {
+      "thread": lambda: concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix="parse"),
+      "process": lambda: concurrent.futures.ProcessPoolExecutor(workers),
+      "inline": lambda: None
+    }[mode]()
+    self.lanes = [] if mode == "inline" else [
+      concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix=f"parse-lane{i}")
+      for i in range(workers)]
+    self.next_lane = itertools.cycle(self.lanes or [None])
+    self.stats = {
+      "jobs": 0,
+      "offloaded_time": 0.0,  # Parse time that would otherwise have blocked the loop
+      "inline_time": 0.0,
+      "slowest": 0.0
+    }
+
+  def record(self, elapsed, offloaded):
+    self.stats["jobs"] += 1
+    self.stats["offloaded_time" if offloaded else "inline_time"] += elapsed
+    self.stats["slowest"] = max(self.stats["slowest"], elapsed)
+    self.metrics.parse_seconds.observe(elapsed, where="pool" if offloaded else "loop")
+
+  async def _submit(self, executor, func, *args):
+    if executor is None:
+      result, elapsed = timed(func, *args)
+    else:
+      loop = asyncio.get_event_loop()
+      result, elapsed = await loop.run_in_executor(executor, timed, func, *args)
+    self.record(elapsed, executor is not None)
+    return result
+
+  async def run(self, func, *args):
+    """Runs a self-contained parsing job"""
+    return await self._submit(self.executor, func, *args)
+
+  def lane(self):
+    """Somewhere to run jobs that share a parser, all on one thread"""
+    return Lane(self, next(self.next_lane))
+
+  def format_stats(self):
+    return (f'{self.mode} parse pool: {self.stats["jobs"]} jobs, '
+            f'{self.stats["offloaded_time"]:.2f}s parsed off the loop, '
+            f'{self.stats["inline_time"]:.2f}s on it, '
+            f'slowest job {self.stats["slowest"] * 1000:.1f}ms')
+
+  def close(self):
+    for lane in self.lanes:
+      lane.shutdown(wait=False)
+    if self.executor:
+      self.executor.shutdown(wait=False)
@@ -0,0 +1,106 @@
+import asyncio
+import collections
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+
+
+def current_task_name(loop):
+  """What the loop's running right now, read from another thread"""
+  task = getattr(asyncio.tasks, "_current_tasks", {}).get(loop)
+  if task is None:
+    return "(between tasks)"
+  get_coro = getattr(task, "get_coro", None)
+  coro = get_coro() if get_coro else getattr(task, "_coro", None)
+  return "task " + getattr(coro, "__qualname__", repr(coro))
+
+
+def frame_name(frame):
+  code = frame.f_code
+  path = os.path.relpath(code.co_filename) if code.co_filename.startswith(os.getcwd()) \
+    else "/".join(code.co_filename.rsplit("/", 2)[-2:])
+  return f"{code.co_name} ({path}:{code.co_firstlineno})"
+
+
+class StackSampler:
+  """Samples the event loop thread's stack from a thread of its own
+
+  Each sample is rooted at the asyncio task that was running, so time spent
+  in a coroutine is attributed to the task it belongs to and not just the
+  event loop's _run_once. Output is in the collapsed format flamegraph.pl
+  and speedscope read. Nothing runs unless a sampler has been started.
+  """
+
+  def __init__(self, loop, interval=0.005):
+    self.loop = loop
+    self.interval = interval
+    self.thread_id = threading.get_ident()  # Made on the loop's thread
+    self.counts = collections.Counter()
+    self.samples = 0
+    self.stopped = threading.Event()
+    self.thread = None
+
+  def start(self):
+    self.thread = threading.Thread(target=self.run, name="stack-sampler", daemon=True)
+    self.thread.start()
+
+  def stop(self):
+    self.stopped.set()
+    self.thread.join()
+
+  def run(self):
+    while not self.stopped.wait(self.interval):
+      frame = sys._current_frames().get(self.thread_id)
+      if frame is None:
+        continue
+      stack = []
+      while frame is not None:
+        stack.append(frame_name(frame))
+        frame = frame.f_back
+      stack.append(current_task_name(self.loop))
+      self.counts[";".join(reversed(stack))] += 1
+      self.samples += 1
+
+  def collapsed(self):
+    return "".join(f"{stack} {count}\n" for stack, count in self.counts.most_common())
+
+
+class Profile:
+  """Runs cProfile and a StackSampler together over some stretch of time"""
+
+  def __init__(self, loop, interval=0.005):
+    self.profiler = cProfile.Profile()
+    self.sampler = StackSampler(loop, interval)
+    self.started = None
+    self.elapsed = None
+
+  def __enter__(self):
+    self.started = time.monotonic()
+    self.sampler.start()
+    self.profiler.enable()
+    return self
+
+  def __exit__(self, *exc):
+    self.profiler.disable()
+    self.sampler.stop()
+    self.elapsed = time.monotonic() - self.started
+
+  def summary(self, sort="cumulative", limit=40):
+    out = io.StringIO()
+    pstats.Stats(self.profiler, stream=out).sort_stats(sort).print_stats(limit)
+    return out.getvalue()
+
+  def files(self, name):
+    """The pstats dump, collapsed stacks and a readable summary, as (filename, bytes)"""
+    # Same as Stats.dump_stats, which only writes to a path
+    dumped = marshal.dumps(pstats.Stats(self.profiler).stats)
+    return [
+      (f"{name}.pstats", dumped),
+      (f"{name}.collapsed", self.sampler.collapsed().encode()),
+      (f"{name}.txt", self.summary().encode())
+    ]
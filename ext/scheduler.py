@@ -0,0 +1,181 @@
+import datetime
+import heapq
+import statistics
+import time
+
+HISTORY_SIZE = 16  # How many past update times we learn a feed's cadence from
+
+
+class UpdateWindow:
+  """A weekly stretch of time when a feed is expected to update
+
+  Hours and weekdays are in UTC, or in the machine's time zone if local.
+  """
+
+  def __init__(self, weekdays, start_hour=0, end_hour=24, local=False):
+    self.weekdays = set(weekdays)
+    self.start_hour = start_hour
+    self.end_hour = end_hour
+    self.local = local
+
+  @classmethod
+  def from_dict(cls, window):
+    return cls(window["weekdays"], window.get("start_hour", 0), window.get("end_hour", 24),
+               window.get("local", False))
+
+  def moment(self, when):
+    return datetime.datetime.fromtimestamp(when) if self.local \
+      else datetime.datetime.utcfromtimestamp(when)
+
+  def contains(self, when):
+    moment = self.moment(when)
+    hour = moment.hour + moment.minute / 60
+    return moment.weekday() in self.weekdays and self.start_hour <= hour < self.end_hour
+
+  def next_start(self, when):
+    """Timestamp of the next time this window opens after when"""
+    day = self.moment(when).replace(hour=0, minute=0, second=0, microsecond=0)
+    for offset in range(8):
+      candidate = day + datetime.timedelta(days=offset, hours=self.start_hour)
+      # Naive datetimes are taken as local time by timestamp()
+      start = candidate.timestamp() if self.local \
+        else candidate.replace(tzinfo=datetime.timezone.utc).timestamp()
+      if candidate.weekday() in self.weekdays and start > when:
+        return start
+    return None
+
+
+class FeedSchedule:
+  """Decides when a single feed should be polled next
+
+  Feeds are polled every min_interval while inside a declared update window or
+  close to when their learned cadence says the next update is due. The rest of
+  the time we back off towards max_interval the longer nothing happens.
+  """
+
+  def __init__(self, key, history=(), windows=(), min_interval=5 * 60,
+               interval=10 * 60, max_interval=2 * 60 * 60):
+    self.key = key
+    self.history = sorted(history)[-HISTORY_SIZE:]
+    self.windows = list(windows)
+    self.min_interval = min_interval
+    self.interval = interval
+    self.max_interval = max(max_interval, min_interval)
+    self.misses = 0  # Polls since we last saw an update
+
+  def cadence(self):
+    """Typical number of seconds between updates, if we've seen enough of them"""
+    if len(self.history) < 3:
+      return None
+    return statistics.median(b - a for a, b in zip(self.history, self.history[1:]))
+
+  def expected_update(self, now):
+    cadence = self.cadence()
+    if not cadence:
+      return None
+    expected = self.history[-1] + cadence
+    # If it's late, keep expecting it one cadence later rather than forever
+    # polling hard because of one skipped update
+    while expected + self.slack(cadence) < now:
+      expected += cadence
+    return expected
+
+  def slack(self, cadence):
+    # How far either side of the expected time we poll tightly
+    return min(max(cadence * 0.05, 15 * 60), 2 * 60 * 60)
+
+  def idle_interval(self):
+    # Double the interval every 6 polls without an update
+    return min(self.max_interval, self.interval * 2 ** (self.misses // 6))
+
+  def next_poll(self, now):
+    """Timestamp this feed should next be polled at"""
+    if any(window.contains(now) for window in self.windows):
+      return now + self.min_interval
+
+    wake_ups = [now + self.idle_interval()]
+    for window in self.windows:
+      start = window.next_start(now)
+      if start:
+        wake_ups.append(start)
+
+    expected = self.expected_update(now)
+    if expected is not None:
+      slack = self.slack(self.cadence())
+      if expected - slack <= now <= expected + slack:
+        return now + self.min_interval
+      if now < expected - slack:
+        wake_ups.append(expected - slack)
+
+    return max(now + self.min_interval, min(wake_ups))
+
+  def polled(self, now, updated):
+    """Records the outcome of a poll and returns when to poll next"""
+    if updated:
+      self.history = (self.history + [now])[-HISTORY_SIZE:]
+      self.misses = 0
+    else:
+      self.misses += 1
+    return self.next_poll(now)
+
+
+class Scheduler:
+  """Priority queue of feeds keyed on when they're next due"""
+
+  def __init__(self):
+    self.schedules = {}
+    self.due_at = {}
+    self.heap = []
+
+  def add(self, schedule, due=None):
+    self.schedules[schedule.key] = schedule
+    self.push(schedule.key, time.time() if due is None else due)
+
+  def remove(self, key):
+    self.schedules.pop(key, None)
+    # Its heap entry goes stale and gets skipped
+    self.due_at.pop(key, None)
+
+  def push(self, key, due):
+    self.due_at[key] = due
+    heapq.heappush(self.heap, (due, key))
+
+  def _drop_stale(self):
+    # Rescheduling leaves the old entry in the heap, skip those
+    while self.heap and self.due_at.get(self.heap[0][1]) != self.heap[0][0]:
+      heapq.heappop(self.heap)
+
+  def pop_due(self, now):
+    """Returns the keys of every feed that's due, taking them off the queue"""
+    due = []
+    self._drop_stale()
+    while self.heap and self.heap[0][0] <= now:
+      _, key = heapq.heappop(self.heap)
+      del self.due_at[key]
+      due.append(key)
+      self._drop_stale()
+    return due
+
+  def due_now(self, now):
+    """Makes every feed due straight away"""
+    for key in self.schedules:
+      self.push(key, now)
+
+  def next_due(self):
+    self._drop_stale()
+    return self.heap[0][0] if self.heap else None
+
+  def sleep_time(self, now, cap=60):
+    next_due = self.next_due()
+    if next_due is None:
+      return cap
+    return min(cap, max(0, next_due - now))
+
+  def record(self, key, now, updated):
+    schedule = self.schedules.get(key)
+    if schedule:
+      self.push(key, schedule.polled(now, updated))
+
+  def history(self, key):
+    schedule = self.schedules.get(key)
+    return schedule.history if schedule else []
@@ -0,0 +1,189 @@
+import asyncio
+import json
+import time
+
+
+class SinkError(Exception):
+  pass
+
+
+class Sink:
+  """Somewhere outside Discord that new posts get published to
+
+  Every sink has its own bounded queue and a single worker draining it, so a
+  slow or dead service only ever backs up its own queue. When the queue is
+  full new events are dropped (and counted) rather than making the poll cycle
+  wait. The worker hands events to send_batch() in batches of up to
+  batch_size, waiting up to batch_delay seconds for a batch to fill up.
+  Subclasses implement send(event), where one failing post doesn't stop the
+  rest of its batch, or send_batch(events) if the service can take several
+  at once, in which case they go out or fail together.
+  """
+
+  name = "sink"
+
+  def __init__(self, bot, queue_size=100, batch_size=10, batch_delay=1, send_interval=0):
+    self.bot = bot
+    self.queue = asyncio.Queue(maxsize=queue_size)
+    self.batch_size = batch_size
+    self.batch_delay = batch_delay
+    self.send_interval = send_interval  # Seconds between sends, for services with tight limits
+    self.task = None
+    self.stats = {
+      "queued": 0,
+      "sent": 0,
+      "failed": 0,
+      "dropped": 0
+    }
+
+  def start(self):
+    self.task = self.bot.loop.create_task(self.run())
+
+  def stop(self):
+    if self.task:
+      self.task.cancel()
+
+  def offer(self, event):
+    """Queues an event without ever waiting, returns False if it was dropped"""
+    try:
+      self.queue.put_nowait(event)
+    except asyncio.QueueFull:
+      self.stats["dropped"] += 1
+      self.bot.logger.warning(f"{self.name} sink is backed up, dropped {event['slug']}")
+      return False
+    self.stats["queued"] += 1
+    return True
+
+  async def next_batch(self):
+    batch = [await self.queue.get()]
+    deadline = time.monotonic() + self.batch_delay
+    while len(batch) < self.batch_size:
+      timeout = deadline - time.monotonic()
+      if timeout <= 0:
+        break
+      try:
+        batch.append(await asyncio.wait_for(self.queue.get(), timeout=timeout))
+      except asyncio.TimeoutError:
+        break
+    return batch
+
+  async def run(self):
+    while True:
+      batch = await self.next_batch()
+      try:
+        await self.send_batch(batch)
+      except asyncio.CancelledError:
+        raise
+      except Exception as err:
+        self.stats["failed"] += len(batch)
+        self.bot.logger.error(f"{self.name} sink failed to publish {len(batch)} posts: {err}")
+
+  async def send_batch(self, events):
+    for i, event in enumerate(events):
+      if i and self.send_interval:
+        await asyncio.sleep(self.send_interval)
+      try:
+        await self.send(event)
+      except asyncio.CancelledError:
+        raise
+      except Exception as err:
+        self.stats["failed"] += 1
+        self.bot.logger.error(f"{self.name} sink failed to publish {event['slug']}: {err}")
+        continue
+      self.stats["sent"] += 1
+
+  async def send(self, event):
+    raise NotImplementedError
+
+  async def post(self, url, headers, body):
+    # Through the bot's pooled client rather than a session per post
+    resp = await self.bot.fetcher.request(url, headers, body)
+    if resp["resp"].status >= 400:
+      raise SinkError(f"{url} returned {resp['resp'].status}")
+    return resp
+
+
+class MastodonSink(Sink):
+  """Posts each update as a status on a Mastodon account"""
+
+  name = "mastodon"
+
+  def __init__(self, bot, instance_url, token, visibility="unlisted", **kwargs):
+    kwargs.setdefault("send_interval", 1)
+    super().__init__(bot, **kwargs)
+    self.url = f"{instance_url.rstrip('/')}/api/v1/statuses"
+    self.headers = {"Authorization": f"Bearer {token}"}
+    self.visibility = visibility
+
+  async def send(self, event):
+    # Mastodon has no bulk endpoint, so a batch is just posted in order
+    await self.post(self.url, self.headers, {
+      "status": f"{event['content']}\n\n #avabot_update #avabot_update_{event['slug']}",
+      "visibility": self.visibility
+    })
+
+
+class WebhookSink(Sink):
+  """POSTs each batch of updates to a URL as a JSON list"""
+
+  name = "webhook"
+
+  def __init__(self, bot, url, headers={}, **kwargs):
+    super().__init__(bot, **kwargs)
+    self.url = url
+    self.headers = {**headers, "Content-Type": "application/json"}
+
+  async def send_batch(self, events):
+    await self.post(self.url, self.headers, json.dumps(events, default=str))
+    self.stats["sent"] += len(events)
+
+
+sink_types = {
+  "mastodon": MastodonSink,
+  "webhook": WebhookSink
+}
+
+
+class SinkPipeline:
+  """Fans new posts out to every configured sink without waiting on any of them
+
+  Configured with a list of dicts, each with a "type" from sink_types and that
+  sink's keyword arguments. The old single mastodon config is still picked up.
+  """
+
+  def __init__(self, bot, configs=()):
+    self.bot = bot
+    self.sinks = []
+    for config in configs:
+      config = dict(config)
+      sink_type = config.pop("type")
+      if sink_type not in sink_types:
+        raise ValueError(f"Unknown sink type: {sink_type}")
+      self.sinks.append(sink_types[sink_type](bot, **config))
+
+  @classmethod
+  def from_config(cls, bot, config):
+    configs = list(getattr(config, "sinks", []))
+    mastodon = getattr(config, "mastodon", None)
+    if mastodon and mastodon.get("token") and mastodon.get("instance_url") \
+       and not any(sink["type"] == "mastodon" for sink in configs):
+      configs.append({"type": "mastodon", **mastodon})
+    return cls(bot, configs)
+
+  def start(self):
+    for sink in self.sinks:
+      sink.start()
+
+  def stop(self):
+    for sink in self.sinks:
+      sink.stop()
+
+  def publish(self, event):
+    for sink in self.sinks:
+      sink.offer(event)
+
+  def format_stats(self):
+    return "\n".join(
+      f"{sink.name}: {sink.stats['sent']} sent, {sink.stats['failed']} failed, "
+      f"{sink.stats['dropped']} dropped, {sink.queue.qsize()} queued"
+      for sink in self.sinks) or "No sinks configured"
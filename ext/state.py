@@ -0,0 +1,66 @@
+async def ensure_table(bot, table, indexes=()):
+  """Creates a table and its secondary indexes if they don't exist yet"""
+  tables = await bot.r.table_list().run(bot.r_connection)
+  if table not in tables:
+    await bot.r.table_create(table).run(bot.r_connection)
+  existing = await bot.r.table(table).index_list().run(bot.r_connection)
+  for index in indexes:
+    if index not in existing:
+      await bot.r.table(table).index_create(index).run(bot.r_connection)
+  if indexes:
+    await bot.r.table(table).index_wait().run(bot.r_connection)
+
+
+class TableCache:
+  """In-memory copy of a RethinkDB table that gets written back in batches
+
+  Reads never touch the database once loaded. Writes only mark the document
+  dirty, and flush() upserts everything dirty in a single query.
+  """
+
+  def __init__(self, bot, table):
+    self.bot = bot
+    self.table = table
+    self.docs = {}
+    self.dirty = set()
+    self.loaded = False
+
+  async def load(self):
+    await ensure_table(self.bot, self.table)
+    cursor = await self.bot.r.table(self.table).run(self.bot.r_connection)
+    self.docs = {doc["id"]: doc async for doc in cursor}
+    self.loaded = True
+    self.bot.logger.info(f"Loaded {len(self.docs)} documents from {self.table}")
+
+  async def reload(self, keys):
+    """Rereads some documents, for when another process may have changed them"""
+    if not keys:
+      return
+    cursor = await self.bot.r.table(self.table).get_all(*keys).run(self.bot.r_connection)
+    fresh = {doc["id"]: doc async for doc in cursor}
+    for key in keys:
+      self.dirty.discard(key)
+      if key in fresh:
+        self.docs[key] = fresh[key]
+      else:
+        self.docs.pop(key, None)
+
+  def get(self, key):
+    return self.docs.get(key)
+
+  def put(self, doc):
+    self.docs[doc["id"]] = doc
+    self.dirty.add(doc["id"])
+
+  async def flush(self):
+    if not self.dirty:
+      return
+    dirty, self.dirty = self.dirty, set()
+    try:
+      await self.bot.r.table(self.table).insert(
+        [self.docs[key] for key in dirty],
+        conflict="replace").run(self.bot.r_connection)
+    except Exception:
+      # Try again next flush
+      self.dirty |= dirty
+      raise
@@ -0,0 +1,104 @@
+import asyncio
+import collections
+
+import discord
+
+
+class SubscriptionIndex:
+  """slug -> subscriptions, kept current by a changefeed on the subscriptions table
+
+  Channel/role IDs are resolved to objects the first time they're announced
+  to and cached until something changes, so announcing doesn't need the
+  database or repeated lookups.
+  """
+
+  def __init__(self, bot):
+    self.bot = bot
+    self.subscriptions = {}  # id -> subscription document
+    self.by_slug = collections.defaultdict(dict)  # slug -> {id: subscription document}
+    self.resolved = {}  # (channel_id, role_id) -> (channel, role)
+    self.ready = asyncio.Event()
+    self.task = None
+
+  def start(self):
+    self.task = self.bot.loop.create_task(self.follow())
+
+  def stop(self):
+    if self.task:
+      self.task.cancel()
+
+  async def follow(self):
+    while True:
+      try:
+        changes = await self.bot.r.table("subscriptions") \
+          .changes(include_initial=True, include_states=True) \
+          .run(self.bot.r_connection)
+        # Build a fresh copy so we keep answering from the old one while the
+        # initial results stream in (they matter after a reconnect)
+        fresh = SubscriptionIndex(self.bot)
+        async for change in changes:
+          if change.get("state") == "ready":
+            self.replace(fresh)
+            fresh = self
+            self.bot.logger.info(f"Subscription index ready, {len(self.subscriptions)} subscriptions")
+          elif "state" not in change:
+            fresh.apply(change.get("old_val"), change.get("new_val"))
+      except asyncio.CancelledError:
+        raise
+      except Exception as err:
+        self.bot.logger.error(f"Subscriptions changefeed died, restarting: {err}")
+        await asyncio.sleep(5)
+
+  def replace(self, other):
+    self.subscriptions = other.subscriptions
+    self.by_slug = other.by_slug
+    self.invalidate()
+    self.ready.set()
+
+  def apply(self, old, new):
+    """Applies a change to a subscription, same shape as a changefeed entry"""
+    if old:
+      self._remove(old["id"])
+    if new:
+      self._remove(new["id"])
+      self.subscriptions[new["id"]] = new
+      self.by_slug[new["slug"]][new["id"]] = new
+
+  def apply_changes(self, results):
+    """Applies the changes from a write run with return_changes=True"""
+    for change in results.get("changes", []):
+      self.apply(change.get("old_val"), change.get("new_val"))
+
+  def _remove(self, sub_id):
+    subscription = self.subscriptions.pop(sub_id, None)
+    if subscription:
+      self.by_slug[subscription["slug"]].pop(sub_id, None)
+
+  def invalidate(self):
+    """Forgets resolved channels and roles, for when guilds/channels/roles change"""
+    self.resolved = {}
+
+  def for_slug(self, slug):
+    """Subscription documents for a comic"""
+    return list(self.by_slug.get(slug, {}).values())
+
+  def resolve(self, channel_id, role_id):
+    """Channel and role (or None) objects for a subscription's IDs"""
+    key = (channel_id, role_id)
+    if key in self.resolved:
+      return self.resolved[key]
+    channel = self.bot.get_channel(int(channel_id))
+    role = discord.utils.get(channel.guild.roles, id=int(role_id)) \
+      if channel and role_id else None
+    # Channels we can't see before we're ready might just not be cached yet
+    if self.bot.is_ready():
+      self.resolved[key] = (channel, role)
+    return channel, role
+
+  def targets(self, slug):
+    targets = []
+    for subscription in self.for_slug(slug):
+      channel, role = self.resolve(subscription["channel_id"], subscription["role_id"])
+      if channel:
+        targets.append({"channel": channel, "role": role})
+    return targets
@@ -0,0 +1,157 @@
+import asyncio
+import contextlib
+import contextvars
+import itertools
+import json
+import os
+import random
+import time
+import weakref
+
+from discord.ext import commands
+
+current_span = contextvars.ContextVar("current_span", default=None)
+not_traced = contextlib.nullcontext()
+
+
+class Span:
+  def __init__(self, tracer, name, cat, args):
+    self.tracer = tracer
+    self.name = name
+    self.cat = cat
+    self.args = args
+    self.token = None
+
+  def __enter__(self):
+    self.token = current_span.set(self)
+    self.tid = self.tracer.track()
+    self.start = time.time()
+    self.started = time.perf_counter()
+    return self
+
+  def __exit__(self, exc_type, exc, tb):
+    duration = time.perf_counter() - self.started
+    current_span.reset(self.token)
+    if exc_type is not None:
+      self.args["error"] = exc_type.__name__
+    self.tracer.emit({
+      "name": self.name,
+      "cat": self.cat,
+      "ph": "X",
+      "ts": int(self.start * 1e6),
+      "dur": int(duration * 1e6),
+      "pid": self.tracer.pid,
+      "tid": self.tid,
+      "args": self.args
+    })
+    if self.tracer.root_of(self):
+      self.tracer.flush()
+
+
+class Tracer:
+  """Nested spans written to a rotating file in Chrome's trace event format
+
+  The files load straight into Perfetto (ui.perfetto.dev) or chrome://tracing.
+  Whether anything gets traced is decided once per root span (a poll cycle,
+  a command) with sample_rate, and spans only nest under a sampled root, so
+  everything else costs one context variable lookup. Each asyncio task gets
+  its own track, so feeds checked concurrently show up side by side.
+  """
+
+  def __init__(self, path=None, sample_rate=0.01, max_bytes=32 * 1024 * 1024, backups=5):
+    self.path = path  # None to never trace
+    self.sample_rate = sample_rate
+    self.max_bytes = max_bytes
+    self.backups = backups
+    self.pid = os.getpid()
+    self.tracks = weakref.WeakKeyDictionary()  # Task -> track number
+    self.track_ids = itertools.count(1)
+    self.pending = []
+    self.file = None
+
+  def root(self, name, cat, force=False, **args):
+    """Starts a trace here, if this one gets sampled"""
+    if not self.path or current_span.get() is not None:
+      return self.span(name, cat, **args)
+    if not force and random.random() >= self.sample_rate:
+      return not_traced
+    return Span(self, name, cat, args)
+
+  def span(self, name, cat="", **args):
+    """A span inside whatever trace is going on, if any"""
+    if current_span.get() is None:
+      return not_traced
+    return Span(self, name, cat, args)
+
+  def root_of(self, span):
+    return current_span.get() is None
+
+  def track(self):
+    try:
+      task = asyncio.current_task()
+    except RuntimeError:
+      task = None
+    if task is None:
+      return 0
+    if task not in self.tracks:
+      self.tracks[task] = next(self.track_ids)
+      get_coro = getattr(task, "get_coro", None)
+      coro = get_coro() if get_coro else getattr(task, "_coro", None)
+      # Names the track after the task in the viewer
+      self.emit({"name": "thread_name", "ph": "M", "pid": self.pid, "tid": self.tracks[task],
+                 "args": {"name": getattr(coro, "__qualname__", "task")}})
+    return self.tracks[task]
+
+  def emit(self, event):
+    self.pending.append(event)
+
+  def flush(self):
+    if not self.pending:
+      return
+    if self.file is None:
+      self.open()
+    # A JSON array that's never closed, which the trace viewers are fine with
+    # and means every write leaves a loadable file
+    self.file.write("".join(json.dumps(event, default=str) + ",\n" for event in self.pending))
+    self.file.flush()
+    self.pending = []
+    if self.file.tell() > self.max_bytes:
+      self.rotate()
+
+  def open(self):
+    os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+    self.file = open(self.path, "a")
+    if self.file.tell() == 0:
+      self.file.write("[\n")
+
+  def rotate(self):
+    self.file.close()
+    self.file = None
+    for i in range(self.backups - 1, 0, -1):
+      if os.path.exists(f"{self.path}.{i}"):
+        os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+    os.replace(self.path, f"{self.path}.1")
+
+  def close(self):
+    self.flush()
+    if self.file:
+      self.file.close()
+      self.file = None
+
+
+def instrument_commands(tracer):
+  """Adds converter and send spans to every command's trace"""
+  do_conversion = commands.Command.do_conversion
+  send = commands.Context.send
+
+  async def traced_conversion(self, ctx, converter, argument, param):
+    with tracer.span(f"convert {param.name}", cat="converter",
+                     converter=getattr(converter, "__name__", str(converter))):
+      return await do_conversion(self, ctx, converter, argument, param)
+
+  async def traced_send(self, *args, **kwargs):
+    with tracer.span("send", cat="discord", channel=getattr(self.channel, "id", None)):
+      return await send(self, *args, **kwargs)
+
+  commands.Command.do_conversion = traced_conversion
+  commands.Context.send = traced_send
@@ -0,0 +1,110 @@
+import asyncio
+import collections
+import inspect
+import os
+import sys
+import threading
+import time
+
+from .profiling import current_task_name, frame_name
+
+
+class LoopWatchdog:
+  """Notices when something blocks the event loop, and catches it in the act
+
+  A coroutine ticks every interval and measures how late each tick was. A
+  thread watches the ticks, and once the loop has gone threshold seconds
+  without one it grabs the loop thread's stack, which is whatever is
+  blocking it. That stack is tagged with the asyncio task that was running
+  and the cog whose code is on it, and gets logged once the loop is free.
+  """
+
+  def __init__(self, bot, interval=0.1, threshold=0.5, keep=20):
+    self.bot = bot
+    self.interval = interval
+    self.threshold = threshold
+    self.stalls = collections.deque(maxlen=keep)  # Most recent last
+    self.last_tick = time.monotonic()
+    self.captured = None
+    self.loop_thread = None
+    self.stopped = threading.Event()
+    self.task = None
+
+  def start(self):
+    self.task = self.bot.loop.create_task(self.run())
+
+  def stop(self):
+    self.stopped.set()
+    if self.task:
+      self.task.cancel()
+
+  async def run(self):
+    self.loop_thread = threading.get_ident()
+    self.last_tick = time.monotonic()
+    threading.Thread(target=self.watch, name="loop-watchdog", daemon=True).start()
+    while True:
+      before = time.monotonic()
+      await asyncio.sleep(self.interval)
+      self.last_tick = time.monotonic()
+      lag = self.last_tick - before - self.interval
+      self.bot.metrics.loop_lag.observe(lag)
+      captured, self.captured = self.captured, None
+      if lag >= self.threshold:
+        self.report(lag, captured)
+
+  def watch(self):
+    while not self.stopped.wait(self.interval / 2):
+      last_tick = self.last_tick
+      if self.captured or time.monotonic() - last_tick < self.threshold:
+        continue
+      frame = sys._current_frames().get(self.loop_thread)
+      if frame is None:
+        continue
+      # Only if the loop hasn't caught up while we were looking
+      capture = {
+        "stack": self.stack(frame),
+        "task": current_task_name(self.bot.loop),
+        "cog": self.cog(frame)
+      }
+      if self.last_tick == last_tick:
+        self.captured = capture
+
+  def stack(self, frame):
+    stack = []
+    while frame is not None:
+      stack.append(f"{frame_name(frame)} line {frame.f_lineno}")
+      frame = frame.f_back
+    return stack  # Innermost first
+
+  def cog(self, frame):
+    """The cog whose code is closest to the top of the stack"""
+    files = {}
+    for name, cog in list(self.bot.cogs.items()):
+      try:
+        files[os.path.abspath(inspect.getfile(type(cog)))] = name
+      except TypeError:
+        pass
+    while frame is not None:
+      name = files.get(os.path.abspath(frame.f_code.co_filename))
+      if name:
+        return name
+      frame = frame.f_back
+    return None
+
+  def report(self, lag, captured):
+    stall = {
+      "time": time.time(),
+      "lag": lag,
+      "task": captured["task"] if captured else None,
+      "cog": captured["cog"] if captured else None,
+      "stack": captured["stack"] if captured else []
+    }
+    self.stalls.append(stall)
+    self.bot.metrics.loop_stalls.inc(cog=stall["cog"] or "unknown")
+    self.bot.logger.warning(self.format(stall))
+
+  def format(self, stall, frames=12):
+    lines = [f"Event loop blocked for {stall['lag']:.2f}s "
+             f"by {stall['task'] or 'unknown task'} in cog {stall['cog'] or 'unknown'}"]
+    lines.extend("  " + frame for frame in stall["stack"][:frames])
+    return "\n".join(lines)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""Polls feeds in a process of its own, without a Discord connection
+
+Set poller = {"separate": True} in avaconfig.py and run this alongside
+avabot.py. This process fetches, parses, saves updates and queues
+announcements in the outbox table. The bot follows the outbox with a
+changefeed and only delivers them, so a heavy cycle can't slow down the
+gateway or commands, and either side can be restarted on its own.
+"""
+
+import asyncio
+import logging
+import os
+import signal
+
+from rethinkdb import RethinkDB
+
+import avaconfig as cfg
+from ext.fetch import Fetcher
+from ext.metrics import Metrics, TimedConnection
+from ext.modular import Modular
+from ext.parsepool import ParsePool
+from ext.tracing import Tracer
+from ext.watchdog import LoopWatchdog
+
+
+class Poller:
+  """The parts of the bot Modular needs to poll, and nothing that talks to Discord"""
+
+  polls = True
+  delivers = False
+
+  def __init__(self, loop):
+    self.loop = loop
+    self.prod = True if os.environ.get("pm_id") else False
+    self.config = cfg
+    settings = getattr(cfg, "poller", {})
+
+    logging.basicConfig(
+      format="[%(levelname)s] - %(message)s",
+      level=logging.INFO if os.environ.get("LOG_INFO") else (
+        logging.INFO if self.prod else logging.DEBUG))
+    self.logger = logging.getLogger("poller")
+    self.metrics = Metrics()
+    # Its own port, the bot's serving its metrics on the usual one
+    if settings.get("metrics"):
+      self.loop.create_task(self.metrics.serve(**settings["metrics"]))
+    # Its own trace file too, two processes can't share one
+    tracing = dict(getattr(cfg, "tracing", {}))
+    if tracing.get("path"):
+      root, ext = os.path.splitext(tracing["path"])
+      tracing["path"] = f"{root}.poller{ext}"
+    self.tracer = Tracer(**tracing)
+    self.fetcher = Fetcher(loop=self.loop, metrics=self.metrics, **getattr(cfg, "http_client", {}))
+    self.session = self.fetcher.session
+    self.parse_pool = ParsePool(metrics=self.metrics, **getattr(cfg, "parse_pool", {}))
+    self.cogs = {}
+    self.watchdog = LoopWatchdog(self, **getattr(cfg, "watchdog", {}))
+    self.watchdog.start()
+
+    self.r = RethinkDB()
+    self.r.set_loop_type("asyncio")
+    self.db_connect_task = self.loop.create_task(self._db_connect())
+
+    self.modular = Modular(self)
+    self.cogs["Modular"] = self.modular
+
+  async def _db_connect(self):
+    conn = await self.r.connect("localhost", 28015, "ava")
+    self.r_connection = TimedConnection(conn, self.metrics, self.tracer)
+    return self.r_connection
+
+  def is_ready(self):
+    # Never connected to Discord, so never ready for anything that needs it
+    return False
+
+  async def close(self):
+    self.modular.cog_unload()
+    if self.modular.leases:
+      await self.modular.leases.leave()
+    self.watchdog.stop()
+    self.parse_pool.close()
+    await self.fetcher.close()
+    await self.metrics.close()
+    self.tracer.close()
+
+  def run(self):
+    for sig in (signal.SIGINT, signal.SIGTERM):
+      self.loop.add_signal_handler(sig, self.loop.stop)
+    self.logger.info("Polling, announcements go to the outbox for the bot to deliver")
+    try:
+      self.loop.run_forever()
+    finally:
+      self.loop.run_until_complete(self.close())
+
+
+if __name__ == "__main__":
+  Poller(asyncio.get_event_loop()).run()